@@ -11,6 +11,10 @@
 
 #==============
 class Agent:
+    # Bots that only look at the move list set this to False.
+    # Then the server doesn't bother to build a board for them.
+    needs_game_state = True
+
     #---------------------
     def __init__(self):
         pass
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: async_leela_engine.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# asyncio version of LeelaEngine. The pipes are read by tasks
+# on the event loop, and waiting for a move does not tie up a thread.
+# Position bookkeeping is inherited from LeelaEngine.
+#
+
+from pdb import set_trace as BP
+import asyncio
+
+from leela_engine import LeelaEngine, MOVE_TIMEOUT
+from gtp_client import GTPClient, GTPError
+
+LINE_LIMIT = 1 << 20 # lz-analyze lines can get long
+
+#======================================
+class AsyncLeelaEngine( LeelaEngine):
+
+    # Don't call this directly. Use  await AsyncLeelaEngine.create(...)
+    #--------------------------------------------------------------------
+    def __init__( self, leela_cmdline, idx=0, diagnostics=True):
+        self.leela_cmdline = leela_cmdline
+        self.idx = idx
+        self.diagnostics = diagnostics
+        self.handler_lock = asyncio.Lock()
+        self.win_prob = -1
+        self.last_playouts = -1
+        self.last_visits = -1
+        # The moves leela currently has on its board. None if unknown.
+        self.moves = []
+        self.closed = False
+        self.leela_proc = None
+        self.gtp = None
+        self.reader_tasks = []
+
+    @classmethod
+    #--------------------------------------------------------------------
+    async def create( cls, leela_cmdline, idx=0, diagnostics=True):
+        engine = cls( leela_cmdline, idx, diagnostics)
+        await engine._start_leelaproc()
+        return engine
+
+    #-----------------------------------
+    async def _start_leelaproc( self):
+        loop = asyncio.get_running_loop()
+        stderr = asyncio.subprocess.PIPE if self.diagnostics else asyncio.subprocess.DEVNULL
+        proc = await asyncio.create_subprocess_exec( *self.leela_cmdline,
+                                                     stdin=asyncio.subprocess.PIPE,
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=stderr,
+                                                     limit=LINE_LIMIT)
+
+        #------------------------
+        def write( cmdstr):
+            if proc.stdin.is_closing():
+                raise BrokenPipeError( 'leela stdin closed')
+            proc.stdin.write( cmdstr.encode('utf8'))
+
+        self.gtp = GTPClient( write, self._diag_handler, loop.create_future)
+        self.leela_proc = proc
+        self.reader_tasks = [ asyncio.create_task( self._read_lines( proc, proc.stdout, self.gtp.feed_line, True)) ]
+        if self.diagnostics:
+            self.reader_tasks.append( asyncio.create_task( self._read_lines( proc, proc.stderr, self._diag_handler)))
+
+    # Feed lines from a pipe to a handler until EOF.
+    # EOF on stdout means leela died.
+    #---------------------------------------------------------------------
+    async def _read_lines( self, proc, stream, handler, is_stdout=False):
+        while True:
+            line = await stream.readline()
+            if not line: break
+            handler( line.decode( 'utf8', 'replace'))
+        if is_stdout:
+            await self._error_handler( proc)
+
+    #-------------------------
+    def kill( self):
+        if self.leela_proc is not None and self.leela_proc.returncode is None:
+            try:
+                self.leela_proc.kill()
+            except ProcessLookupError:
+                pass
+
+    # Resurrect a dead Leela
+    #-----------------------------------------------
+    async def _error_handler( self, proc=None):
+        async with self.handler_lock:
+            if self.closed: return
+            if proc is not None and proc is not self.leela_proc:
+                return # Already resurrected
+            print( 'Leela %d died. Resurrecting.' % self.idx)
+            self.kill()
+            self.gtp.fail_all( 'leela %d died' % self.idx)
+            self.moves = None
+            await self._start_leelaproc()
+            print( 'Leela %d resurrected' % self.idx)
+
+    # Set up the position and ask leela for a move.
+    # Returns (move, win_prob). Move is None if leela timed out,
+    # or refused a move of the position.
+    #-------------------------------------------------------------------
+    async def genmove( self, moves, randomness=0.0, playouts=0, timeout=MOVE_TIMEOUT):
+        self.win_prob = -1
+        self.last_playouts = -1
+        self.last_visits = -1
+
+        sync_futures = self.sync_moves( moves)
+        color = 'b' if len(moves) % 2 == 0 else 'w'
+
+        # Ask for new move
+        cmd = 'genmove ' + color + ' ' + str(randomness) + ' ' + str(playouts)
+        fut = self._leelaCmd( cmd)
+        print( 'sending %s to leela %d' % (cmd, self.idx))
+        try:
+            await self.leela_proc.stdin.drain()
+            resp = await asyncio.wait_for( fut, timeout)
+        except asyncio.TimeoutError: # I guess leela died
+            print( 'error: leela %d response timeout' % self.idx)
+            await self._error_handler()
+            return None, -1
+        except (GTPError, ConnectionError) as e:
+            print( 'error: leela %d: %s' % (self.idx, str(e)))
+            self.moves = None
+            return None, -1
+        # If leela refused a move, it answered for a different position
+        if not self._check_sync( sync_futures):
+            return None, -1
+        res = self._resp2Move( resp)
+        # Leela played its move on its own board
+        self._record_genmove( res)
+        return res, self.win_prob
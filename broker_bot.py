@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: broker_bot.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# A bot that asks the engine broker for moves, over a Unix socket.
+# The web workers use this, and only the broker runs leelaz.
+# See engine_broker.py for the protocol.
+#
+
+from pdb import set_trace as BP
+import json
+import socket
+import threading
+
+from agent_base import Agent
+from goboard_fast import Move
+from go_utils import point_from_coords
+from playout_scheduler import DeadlineExceededError
+from game_sessions import LazyGameState
+import cancel_token
+
+# Longest we wait for the broker to answer a request
+BROKER_TIMEOUT = 120 # seconds
+
+#==============================
+class BrokerError(Exception):
+    pass
+
+#===========================
+class BrokerClientBot( Agent):
+    # The broker only sends the moves on
+    needs_game_state = False
+
+    #--------------------------------------------------------------------
+    def __init__( self, socket_path, bot_name='leela_gtp_bot', timeout=BROKER_TIMEOUT):
+        Agent.__init__( self)
+        self.socket_path = socket_path
+        self.bot_name = bot_name
+        self.timeout = timeout
+        # Per request thread: the diagnostics that came with the move
+        self.tls = threading.local()
+
+    # Connect, send one request, and return the file we read answers from
+    #-------------------------------------------------------------------------
+    def _send( self, request):
+        request['bot'] = self.bot_name
+        sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout( self.timeout)
+        try:
+            sock.connect( self.socket_path)
+            sock.sendall( (json.dumps( request) + '\n').encode())
+            return sock, sock.makefile( 'r')
+        except:
+            sock.close()
+            raise
+
+    # Read one answer line. Broker errors become exceptions.
+    #----------------------------------------------------------
+    def _read( self, rfile):
+        line = rfile.readline()
+        if not line:
+            raise BrokerError( 'broker hung up')
+        res = json.loads( line)
+        if res.get( 'status') == 'shed':
+            raise DeadlineExceededError( res['error'])
+        if 'error' in res:
+            raise BrokerError( res['error'])
+        return res
+
+    # Hanging up makes the broker cancel the request
+    #---------------------------------------------------
+    def _hang_up( self, sock):
+        try:
+            sock.shutdown( socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    # One request, one answer. If the current CancelToken fires,
+    # we hang up and raise RequestCancelledError.
+    #---------------------------------------------------------------
+    def _call( self, request):
+        cancel = cancel_token.current()
+        sock, rfile = self._send( request)
+        hang_up = lambda: self._hang_up( sock)
+        if cancel is not None:
+            cancel.on_cancel( hang_up)
+        try:
+            return self._read( rfile)
+        except (BrokerError, OSError):
+            if cancel is not None:
+                cancel.check()
+            raise
+        finally:
+            if cancel is not None:
+                cancel.remove( hang_up)
+            rfile.close()
+            sock.close()
+
+    # Override Agent.select_move()
+    #--------------------------------------------------------
+    def select_move( self, game_state, moves, config = {}):
+        self.tls.diag = {}
+        if isinstance( game_state, LazyGameState): # Don't replay just for the size
+            board_size = game_state.board_size
+        else:
+            board_size = game_state.board.num_rows
+        res = self._call( { 'cmd': 'select_move',
+                            'board_size': board_size,
+                            'moves': moves,
+                            'config': config })
+        self.tls.diag = res['diagnostics']
+        return self._str2move( res['bot_move'])
+
+    # Override Agent.diagnostics()
+    #------------------------------
+    def diagnostics( self):
+        return getattr( self.tls, 'diag', {})
+
+    # Same as LeelaGTPBot.genmove_batch()
+    #-----------------------------------------------
+    def genmove_batch( self, positions, playouts=0):
+        res = self._call( { 'cmd': 'genmove_batch',
+                            'positions': positions,
+                            'playouts': playouts })
+        return [ (self._str2move( move_str) if move_str else None, win_prob, visits)
+                 for move_str, win_prob, visits in res['results'] ]
+
+    # Same as LeelaGTPBot.analyze(). Closing the generator or cancelling
+    # hangs up on the broker, which then stops the engine.
+    #------------------------------------------------------------------------
+    def analyze( self, moves, max_visits=1000, max_seconds=10.0, interval_centis=50, cancel=None):
+        sock, rfile = self._send( { 'cmd': 'analyze',
+                                    'moves': moves,
+                                    'max_visits': max_visits,
+                                    'max_seconds': max_seconds,
+                                    'interval_centis': interval_centis })
+        if cancel is not None:
+            cancel.on_cancel( lambda: self._hang_up( sock))
+        try:
+            while True:
+                try:
+                    res = self._read( rfile)
+                except (BrokerError, OSError):
+                    if cancel is not None and cancel.cancelled:
+                        break
+                    raise
+                if res.get( 'done'):
+                    break
+                yield res['candidates']
+        finally:
+            rfile.close()
+            sock.close()
+
+    #--------------------------------
+    def _str2move( self, move_str):
+        if move_str == 'pass':
+            return Move.pass_turn()
+        elif move_str == 'resign':
+            return Move.resign()
+        return Move.play( point_from_coords( move_str))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: build_opening_book.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Build an opening book by letting leelaz analyze a tree of
+# common openings, starting from the empty board.
+# Every analyzed position gets its best candidates in the book.
+# The most visited candidates get expanded, down to a given depth.
+#
+
+from pdb import set_trace as BP
+import os, sys
+import argparse
+import time
+
+from game_sessions import replay_moves
+from leela_engine import LeelaEngine
+from opening_book import write_book, book_key
+
+#---------------------------
+def usage( printmsg=False):
+    name = os.path.basename( __file__)
+    msg = '''
+    Name:
+      %s -- Build an opening book with leelaz
+    Synopsis:
+      %s [--depth <n>] [--breadth <n>] [--seconds <s>] [--min_share <f>] --out <book file>
+    Description:
+      Analyze positions breadth first from the empty board.
+      For each position, the best <breadth> candidates go into the book,
+      weighted by visits. Candidates with at least <min_share> of the
+      visits get expanded, down to <depth> moves.
+    Example:
+      %s --depth 12 --breadth 3 --seconds 5 --out opening_book.bin
+    ''' % (name,name,name)
+    if printmsg:
+        print( msg)
+        exit( 1)
+    else:
+        return msg
+
+#-----------
+def main():
+    parser = argparse.ArgumentParser( usage=usage())
+    parser.add_argument( '--depth', type=int, default=12)
+    parser.add_argument( '--breadth', type=int, default=3)
+    parser.add_argument( '--seconds', type=float, default=5.0)
+    parser.add_argument( '--min_share', type=float, default=0.1)
+    parser.add_argument( '--leela_cmd', default='./leelaz -w best-network -t 4 --noponder')
+    parser.add_argument( '--out', required=True)
+    args = parser.parse_args()
+
+    engine = LeelaEngine( args.leela_cmd.split())
+    entries = {}
+    max_moves = 0
+    queue = [[]] # move lists still to analyze
+    tstart = time.time()
+    while queue:
+        moves = queue.pop( 0)
+        game_state = replay_moves( 19, moves)
+        key = book_key( game_state)
+        if key in entries: # transposition
+            continue
+        cands = engine.analyze( moves, args.seconds)
+        cands = [c for c in cands if c['visits'] > 0][:args.breadth]
+        if not cands:
+            continue
+        entries[key] = [ (c['move'], float(c['visits']), c['winrate']) for c in cands ]
+        max_moves = max( max_moves, len(moves))
+        print( '%d positions, %.0f s: %s -> %s' %
+               (len(entries), time.time() - tstart, ' '.join(moves), ' '.join( [c['move'] for c in cands])))
+        if len(moves) + 1 >= args.depth:
+            continue
+        total = sum( [c['visits'] for c in cands])
+        for c in cands:
+            if c['move'].lower() in ('pass', 'resign'): continue
+            if c['visits'] >= args.min_share * total:
+                queue.append( moves + [c['move']])
+
+    write_book( args.out, entries, max_moves=max_moves)
+    print( 'Wrote %d positions to %s' % (len(entries), args.out))
+    engine.close()
+
+if __name__ == '__main__':
+    main()
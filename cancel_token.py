@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: cancel_token.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Cancel work nobody is waiting for anymore.
+# A request gets a CancelToken. Whoever does the work registers
+# a callback that stops it. The token gets cancelled when the client
+# hangs up (DisconnectWatcher) or when a newer request replaces it.
+#
+
+from pdb import set_trace as BP
+import socket
+import time
+import contextvars
+import contextlib
+from threading import Lock, Thread
+
+# How often we look for clients that hung up
+POLL_SECONDS = 0.25
+
+#==========================================
+class RequestCancelledError(Exception):
+    pass
+
+#=====================
+class CancelToken:
+
+    #----------------------
+    def __init__( self):
+        self.lock = Lock()
+        self.cancelled = False
+        self.reason = ''
+        self.callbacks = []
+
+    # Cancel, and run the callbacks. Only the first call counts.
+    #---------------------------------------------------------------
+    def cancel( self, reason='cancelled'):
+        with self.lock:
+            if self.cancelled: return
+            self.cancelled = True
+            self.reason = reason
+            callbacks = self.callbacks
+            self.callbacks = []
+        for func in callbacks:
+            try:
+                func()
+            except Exception as e:
+                print( 'error: cancel callback: %s' % str(e))
+
+    # Run func() on cancel, right away if we are cancelled already
+    #-----------------------------------------------------------------
+    def on_cancel( self, func):
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append( func)
+                return
+        func()
+
+    #----------------------------
+    def remove( self, func):
+        with self.lock:
+            if func in self.callbacks:
+                self.callbacks.remove( func)
+
+    #-------------------
+    def check( self):
+        if self.cancelled:
+            raise RequestCancelledError( self.reason)
+
+# The token of the request this thread or task works on
+_current = contextvars.ContextVar( 'cancel_token', default=None)
+
+#--------------
+def current():
+    return _current.get()
+
+@contextlib.contextmanager
+# with use( token): ...  makes token the current one
+#-------------------------------------------------------
+def use( token):
+    reset = _current.set( token)
+    try:
+        yield token
+    finally:
+        _current.reset( reset)
+
+# Only the latest request per game counts. If the user undoes
+# a move while leela still thinks, the old search is wasted.
+#================================================================
+class LatestRequests:
+
+    #----------------------
+    def __init__( self):
+        self.lock = Lock()
+        self.latest = {} # game_id -> (what, token)
+
+    # A request about what (e.g. the move list) arrived for game_id.
+    # Cancels the previous request for the game, unless it is about the same thing.
+    #-----------------------------------------------------------------------------------
+    def start( self, game_id, what, token):
+        if game_id is None: return
+        with self.lock:
+            prev = self.latest.get( game_id)
+            self.latest[game_id] = (what, token)
+        if prev is not None and prev[0] != what:
+            prev[1].cancel( 'superseded by a newer request')
+
+    #---------------------------------
+    def finish( self, game_id, token):
+        if game_id is None: return
+        with self.lock:
+            if game_id in self.latest and self.latest[game_id][1] is token:
+                del self.latest[game_id]
+
+# One thread that notices when clients hang up on us,
+# and cancels their tokens.
+#=======================================================
+class DisconnectWatcher:
+
+    #----------------------
+    def __init__( self):
+        self.lock = Lock()
+        self.watched = {} # token -> socket
+        self.thread = None
+
+    #---------------------------------
+    def watch( self, sock, token):
+        if sock is None: return
+        with self.lock:
+            self.watched[token] = sock
+            if self.thread is None:
+                self.thread = Thread( target = self._run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    #----------------------------
+    def unwatch( self, token):
+        with self.lock:
+            self.watched.pop( token, None)
+
+    #-------------------
+    def _run( self):
+        while True:
+            time.sleep( POLL_SECONDS)
+            with self.lock:
+                watched = list( self.watched.items())
+            for token, sock in watched:
+                if hung_up( sock):
+                    self.unwatch( token)
+                    token.cancel( 'client disconnected')
+
+# Did the other end close the connection? A closed socket reads
+# as empty. Pending data means the client is still there.
+#------------------------------------------------------------------
+def hung_up( sock):
+    try:
+        return sock.recv( 1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
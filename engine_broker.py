@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: engine_broker.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# One process that owns all leelaz engines. The gunicorn workers
+# talk to it through a Unix socket with BrokerClientBot, so the
+# number of web workers and the number of engines are independent.
+#
+# Protocol: one JSON object per line. The client sends a request
+#   {'cmd':'select_move', 'board_size':19, 'moves':[...], 'config':{...}}
+#   {'cmd':'genmove_batch', 'positions':[[...],...], 'playouts':0}
+#   {'cmd':'analyze', 'moves':[...], 'max_visits':..., 'max_seconds':..., 'interval_centis':...}
+# and gets one answer line, or for analyze one line per report and {'done':true}.
+# Failures come back as {'error':msg}, shed requests as {'status':'shed', 'error':msg}.
+#
+
+from pdb import set_trace as BP
+import os, sys
+import argparse
+import json
+import socketserver
+
+from get_bot_app import move_to_str
+from game_sessions import game_state_for
+from leela_gtp_bot import LeelaGTPBot
+from move_cache import MoveCache
+from gamestate_cache import GameStateCache
+from playout_scheduler import PlayoutScheduler, DeadlineExceededError
+from cancel_token import CancelToken, DisconnectWatcher, RequestCancelledError
+import cancel_token
+
+#---------------------------
+def usage( printmsg=False):
+    name = os.path.basename( __file__)
+    msg = '''
+    Name:
+      %s -- Run the leelaz engines for all web workers
+    Synopsis:
+      %s [--engines <n>] [--spares <n>] [--leela_cmd <cmd>] --socket <path>
+    Description:
+      Start the engines and answer requests from BrokerClientBot
+      on a Unix socket. Start the web server with LEELA_BROKER_SOCKET=<path>.
+    Example:
+      %s --engines 4 --socket /tmp/leela_broker.sock
+    ''' % (name,name,name)
+    if printmsg:
+        print( msg)
+        exit( 1)
+    else:
+        return msg
+
+#==========================================================
+class BrokerHandler( socketserver.StreamRequestHandler):
+
+    # One connection, any number of requests, one at a time.
+    # If the client hangs up, whatever it asked for gets cancelled.
+    #------------------------------------------------------------------
+    def handle( self):
+        for line in self.rfile:
+            if not line.strip(): continue
+            token = CancelToken()
+            self.server.watcher.watch( self.connection, token)
+            try:
+                with cancel_token.use( token):
+                    self._dispatch( json.loads( line), token)
+            except (BrokenPipeError, ConnectionResetError, RequestCancelledError): # Client went away
+                return
+            except DeadlineExceededError as e:
+                self._write( { 'status': 'shed', 'error': str(e) })
+            except Exception as e:
+                print( 'error: broker: %s' % str(e))
+                self._write( { 'error': str(e) })
+            finally:
+                self.server.watcher.unwatch( token)
+
+    #-------------------------
+    def _write( self, res):
+        self.wfile.write( (json.dumps( res) + '\n').encode())
+        self.wfile.flush()
+
+    #------------------------------
+    def _dispatch( self, req, token):
+        bot = self.server.bot_map[req.get( 'bot', 'leela_gtp_bot')]
+        cmd = req['cmd']
+        if cmd == 'select_move':
+            game_state = game_state_for( bot, req['board_size'], req['moves'], self.server.game_states.replay)
+            bot_move = bot.select_move( game_state, req['moves'], req.get( 'config', {}))
+            self._write( { 'bot_move': move_to_str( bot_move), 'diagnostics': bot.diagnostics() })
+        elif cmd == 'genmove_batch':
+            answers = bot.genmove_batch( req['positions'], req.get( 'playouts', 0))
+            self._write( { 'results': [ (move_to_str( bot_move) if bot_move else None, win_prob, visits)
+                                        for bot_move, win_prob, visits in answers ] })
+        elif cmd == 'analyze':
+            reports = bot.analyze( req['moves'], req.get( 'max_visits', 1000),
+                                   req.get( 'max_seconds', 10.0), req.get( 'interval_centis', 50), token)
+            try: # A failed write closes reports, which stops the engine
+                for cands in reports:
+                    self._write( { 'candidates': cands })
+            finally:
+                reports.close()
+            self._write( { 'done': True })
+        else:
+            self._write( { 'error': 'unknown command %s' % cmd })
+
+# A thread per connection
+#===============================================================
+class EngineBroker( socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    # If something needs a board, replays start from the deepest
+    # position in game_states, shared by all clients.
+    #---------------------------------------------------------------
+    def __init__( self, socket_path, bot_map, game_states=None):
+        self.bot_map = bot_map
+        self.game_states = GameStateCache() if game_states is None else game_states
+        self.watcher = DisconnectWatcher()
+        if os.path.exists( socket_path): # Left over from last time
+            os.unlink( socket_path)
+        socketserver.ThreadingUnixStreamServer.__init__( self, socket_path, BrokerHandler)
+
+#-----------
+def main():
+    parser = argparse.ArgumentParser( usage=usage())
+    parser.add_argument( '--socket', required=True)
+    parser.add_argument( '--engines', type=int, default=1)
+    parser.add_argument( '--spares', type=int, default=1)
+    parser.add_argument( '--leela_cmd', default='./leelaz -w best-network -t 1 -p 256 -m 25 --randomtemp 2 -r 0 --noponder')
+    args = parser.parse_args()
+
+    # Same setup as leela_server.py
+    cache = MoveCache( maxsize=100000, ttl=24 * 3600)
+    scheduler = PlayoutScheduler( default_deadline=10.0, default_playouts=256)
+    # LEELA_PONDER=0 turns pondering off
+    ponder_cache = MoveCache( maxsize=10000, ttl=120) if os.environ.get( 'LEELA_PONDER', '1') != '0' else None
+    bot = LeelaGTPBot( args.leela_cmd.split(), args.engines, cache, args.spares, scheduler, ponder_cache)
+
+    server = EngineBroker( args.socket, {'leela_gtp_bot':bot}, GameStateCache( max_states=20000, snapshot_every=8))
+    print( 'Engine broker listening on %s with %d engines' % (args.socket, args.engines))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        bot.pool.kill_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: engine_pool.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# A pool of engines. Each request checks out an idle engine,
+# uses it, and checks it back in. Requests queue up if all
+# engines are busy.
+#
+
+from pdb import set_trace as BP
+import asyncio
+from threading import Condition, Thread
+from contextlib import contextmanager, asynccontextmanager
+
+SPARE_READY_TIMEOUT = 120 # seconds to load the weights
+
+#======================================
+class PoolTimeoutError(Exception):
+    pass
+
+# Remove and return the idle engine that is cheapest to bring
+# to the given moves. Without moves, the most recently used one.
+#-----------------------------------------------------------------
+def _pick_idle( idle, moves):
+    idx = len(idle) - 1
+    if moves is not None:
+        costs = [eng.sync_cost( moves) for eng in idle]
+        idx = costs.index( min( costs))
+    return idle.pop( idx)
+
+#===================
+class EnginePool:
+
+    # n_spares engines get started and loaded ahead of time.
+    # If an engine dies, a spare takes its place right away.
+    #------------------------------------------------------------------
+    def __init__( self, engine_factory, n_engines=1, n_spares=0):
+        self.engine_factory = engine_factory
+        self.engines = [self._new_engine( idx) for idx in range( n_engines)]
+        self._idle = list( self.engines)
+        self._cond = Condition()
+        self.n_waiting = 0
+        self.spares = []
+        # Engines doing background work -> function to make them stop
+        self.background = {}
+        self.closed = False
+        for _ in range( n_spares):
+            self._spawn_spare()
+
+    #-------------------------------
+    def _new_engine( self, idx):
+        eng = self.engine_factory( idx)
+        eng.on_death = self._replace
+        return eng
+
+    # Start a spare engine in the background. It joins the spares
+    # once it has loaded the weights.
+    #-----------------------------------------------------------------
+    def _spawn_spare( self):
+        #--------------
+        def run():
+            eng = self._new_engine( -1)
+            try:
+                eng.wait_ready( SPARE_READY_TIMEOUT)
+            except Exception as e:
+                print( 'error: spare leela did not start: %s' % str(e))
+                eng.close()
+                return
+            with self._cond:
+                if self.closed:
+                    eng.close()
+                    return
+                self.spares.append( eng)
+            print( 'Spare leela ready')
+
+        thread = Thread( target = run)
+        thread.daemon = True
+        thread.start()
+
+    # An engine died. Put a warm spare in its place and start
+    # a new spare. Returns False if there was no spare ready.
+    # A dead spare is not serving anybody. It gets dropped, and we
+    # return True so it does not resurrect. Spares that die while
+    # loading are handled in _spawn_spare().
+    #-------------------------------------------------------------------
+    def _replace( self, dead):
+        with self._cond:
+            if dead not in self.engines:
+                if dead not in self.spares or self.closed:
+                    return True
+                self.spares.remove( dead)
+                spare = None
+            elif self.closed or not self.spares:
+                return False
+            else:
+                spare = self.spares.pop()
+                spare.idx = dead.idx
+                self.engines[self.engines.index( dead)] = spare
+                if dead in self._idle:
+                    self._idle.remove( dead)
+                self._idle.append( spare)
+                self._cond.notify()
+        if spare is None:
+            print( 'Spare leela died')
+        else:
+            print( 'Leela %d died. Swapped in a spare.' % dead.idx)
+        self._spawn_spare()
+        return True
+
+    #----------------------
+    def __len__( self):
+        return len( self.engines)
+
+    # Get an idle engine. Wait in line if they are all busy.
+    # If we know the moves, prefer the engine that is closest
+    # to that position. If the CancelToken cancel fires while
+    # we wait, we leave the line with RequestCancelledError.
+    #---------------------------------------------------------
+    def checkout( self, timeout=None, moves=None, cancel=None):
+        #------------------
+        def wake_up():
+            with self._cond:
+                self._cond.notify_all()
+
+        if cancel is not None:
+            cancel.on_cancel( wake_up)
+        try:
+            with self._cond:
+                self.n_waiting += 1
+                try:
+                    if not self._idle: # Real work first
+                        for preempt in self.background.values():
+                            preempt()
+                    if not self._cond.wait_for( lambda: self._idle or (cancel and cancel.cancelled), timeout):
+                        raise PoolTimeoutError( 'No idle engine after %s seconds' % str(timeout))
+                    if cancel is not None and cancel.cancelled:
+                        if self._idle: # Somebody else gets it
+                            self._cond.notify()
+                        cancel.check()
+                    return _pick_idle( self._idle, moves)
+                finally:
+                    self.n_waiting -= 1
+        finally:
+            if cancel is not None:
+                cancel.remove( wake_up)
+
+    # Get an idle engine for background work, or None if there is no
+    # engine to spare. As soon as a real request has to wait, we call
+    # preempt(). Then the engine should stop and get checked in quickly.
+    #----------------------------------------------------------------------
+    def checkout_background( self, preempt, moves=None):
+        with self._cond:
+            if self.closed or not self._idle or self.n_waiting:
+                return None
+            engine = _pick_idle( self._idle, moves)
+            self.background[engine] = preempt
+            return engine
+
+    # Give an engine back to the pool and wake up one waiter.
+    # A closed engine has already been replaced by a spare.
+    #---------------------------------------------------------
+    def checkin( self, engine):
+        with self._cond:
+            self.background.pop( engine, None)
+            if engine.closed: return
+            self._idle.append( engine)
+            self._cond.notify()
+
+    @contextmanager
+    # with pool.engine() as eng: ...
+    #---------------------------------------
+    def engine( self, timeout=None, moves=None, cancel=None):
+        eng = self.checkout( timeout, moves, cancel)
+        try:
+            yield eng
+        finally:
+            self.checkin( eng)
+
+    #-------------------
+    def kill_all( self):
+        with self._cond:
+            self.closed = True
+        for eng in self.engines + self.spares:
+            eng.close()
+
+# Same thing for engines driven from asyncio.
+# Waiting for an engine does not block a thread.
+#===============================================
+class AsyncEnginePool:
+
+    # engine_factory( idx) is a coroutine returning a started engine
+    #------------------------------------------------------------------
+    def __init__( self, engine_factory, n_engines=1):
+        self.engine_factory = engine_factory
+        self.n_engines = n_engines
+        self.engines = []
+        self._idle = []
+        self._cond = None
+        self.n_waiting = 0
+
+    # Start the engines. Must run on the event loop that will use them.
+    #---------------------------------------------------------------------
+    async def start( self):
+        self._cond = asyncio.Condition()
+        self.engines = await asyncio.gather( *[self.engine_factory( idx) for idx in range( self.n_engines)])
+        self._idle = list( self.engines)
+
+    #----------------------
+    def __len__( self):
+        return len( self.engines)
+
+    # Get an idle engine. Wait in line if they are all busy.
+    #---------------------------------------------------------
+    async def checkout( self, timeout=None, moves=None):
+        async with self._cond:
+            self.n_waiting += 1
+            try:
+                await asyncio.wait_for( self._cond.wait_for( lambda: self._idle), timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeoutError( 'No idle engine after %s seconds' % str(timeout))
+            finally:
+                self.n_waiting -= 1
+            return _pick_idle( self._idle, moves)
+
+    #-----------------------------------
+    async def checkin( self, engine):
+        async with self._cond:
+            self._idle.append( engine)
+            self._cond.notify()
+
+    @asynccontextmanager
+    # async with pool.engine() as eng: ...
+    #------------------------------------------------
+    async def engine( self, timeout=None, moves=None):
+        eng = await self.checkout( timeout, moves)
+        try:
+            yield eng
+        finally:
+            await self.checkin( eng)
+
+    #-------------------
+    def kill_all( self):
+        for eng in self.engines:
+            eng.close()
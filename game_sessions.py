@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: game_sessions.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Games the server remembers, so clients only send new moves.
+# Each game has its GameState and move list, and a sequence number
+# that goes up with every change. A client whose sequence number
+# does not match is out of sync and has to start over.
+#
+
+from pdb import set_trace as BP
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+import goboard_fast as goboard
+from go_utils import point_from_coords
+
+#==================================
+class OutOfSyncError(Exception):
+    pass
+
+# 'D4', 'pass', 'resign' -> Move
+#-----------------------------------
+def str_to_move( move_str):
+    if move_str == 'pass':
+        return goboard.Move.pass_turn()
+    elif move_str == 'resign':
+        return goboard.Move.resign()
+    return goboard.Move.play( point_from_coords( move_str))
+
+# Move for a client's move string, if it is legal in game_state.
+# Raises IllegalMoveError otherwise.
+#-------------------------------------------------------------------
+def parse_move( game_state, move_str):
+    try:
+        move = str_to_move( move_str)
+    except (ValueError, IndexError, TypeError, AttributeError):
+        raise goboard.IllegalMoveError( 'not a move: %s' % str(move_str))
+    if move.is_play and not game_state.board.is_on_grid( move.point):
+        raise goboard.IllegalMoveError( 'off the board: %s' % move_str)
+    if not game_state.is_valid_move( move):
+        raise goboard.IllegalMoveError( 'illegal move: %s' % move_str)
+    return move
+
+# Replay a list of moves like ['D4','Q16','pass'] into a GameState
+#--------------------------------------------------------------------
+def replay_moves( board_size, moves):
+    game_state = goboard.GameState.new_game( board_size)
+    for move in moves:
+        game_state = game_state.apply_move( str_to_move( move))
+    return game_state
+
+# Looks like a GameState, but only replays the moves if somebody
+# actually looks at it. For bots that only need the move list.
+#=====================================================================
+class LazyGameState:
+
+    # replay is replay_moves() or something that does the same
+    #--------------------------------------------------------------
+    def __init__( self, board_size, moves, replay=replay_moves):
+        self.board_size = board_size
+        self.moves = moves
+        self.replay = replay
+        self._game_state = None
+
+    @property
+    #------------------------
+    def game_state( self):
+        if self._game_state is None:
+            self._game_state = self.replay( self.board_size, self.moves)
+        return self._game_state
+
+    @property
+    # Did somebody look already
+    #---------------------------
+    def replayed( self):
+        return self._game_state is not None
+
+    # Everything else comes from the real thing
+    #--------------------------------------------
+    def __getattr__( self, name):
+        return getattr( self.game_state, name)
+
+# A key for the position in game_state, for caches.
+# If there is a board anyway, the zobrist hash and the ko point, so
+# transpositions share. A LazyGameState nobody looked at gets keyed by
+# board size and moves, so we don't replay the game just for the key.
+# The hash key does not know the superko history. Check answers
+# with fits_position().
+#------------------------------------------------------------------------
+def position_key( game_state):
+    if isinstance( game_state, LazyGameState) and not game_state.replayed:
+        return ( game_state.board_size, tuple( [m.upper() for m in game_state.moves]) )
+    board = game_state.board
+    player = game_state.next_player
+    return ( board.zobrist_hash(), board.num_rows, board.num_cols, player, board.ko_point( player) )
+
+# Can an answer found under position_key( game_state) be played in game_state?
+# Keys from the move list are exact, and we don't replay to check those.
+#-----------------------------------------------------------------------------------
+def fits_position( game_state, move):
+    if move is None or (isinstance( game_state, LazyGameState) and not game_state.replayed):
+        return True
+    return game_state.is_valid_move( move)
+
+# What a bot gets to see: a real GameState if it says it needs one
+# The replay function can come from a GameStateCache.
+#--------------------------------------------------------------------
+def game_state_for( bot_agent, board_size, moves, replay=replay_moves):
+    if getattr( bot_agent, 'needs_game_state', True):
+        return replay( board_size, moves)
+    return LazyGameState( board_size, moves, replay)
+
+#=====================
+class GameSession:
+
+    # owner is the GameSessions we are in. It wants to hear when
+    # the game gets longer or shorter.
+    #----------------------------------------------------------------
+    def __init__( self, game_id, board_size, owner=None):
+        self.game_id = game_id
+        self.board_size = board_size
+        self.game_state = goboard.GameState.new_game( board_size)
+        self.moves = []
+        self.seq = 0
+        self.lock = Lock()
+        self.last_used = time.time()
+        self.owner = owner
+
+    # The session pins one GameState per move, and the empty board
+    #-----------------------------------------------------------------
+    def n_states( self):
+        return len(self.moves) + 1
+
+    # Take back undo moves, then play moves, on the side.
+    # Returns the new GameState and move list. Raises IllegalMoveError,
+    # and then the game is unchanged. GameState remembers where it came from.
+    # Caller holds the lock.
+    #-----------------------------------------------------------------------------
+    def _replayed( self, moves=(), undo=0):
+        undo = min( undo, len(self.moves))
+        game_state = self.game_state
+        for _ in range( undo):
+            game_state = game_state.previous_state
+        for move_str in moves:
+            move = parse_move( game_state, move_str)
+            game_state = game_state.apply_move( move)
+        return game_state, self.moves[:len(self.moves) - undo] + list( moves)
+
+    # Make the change for real. Caller holds the lock.
+    #-----------------------------------------------------
+    def _apply( self, moves=(), undo=0):
+        n = len(self.moves)
+        self.game_state, self.moves = self._replayed( moves, undo)
+        if self.owner is not None:
+            self.owner._resized( self, len(self.moves) - n)
+
+    # Apply a client's change if its seq is current. Returns the new seq,
+    # the GameState and a copy of the moves, all from the same instant.
+    #--------------------------------------------------------------------------
+    def update( self, seq, moves=(), undo=0):
+        with self.lock:
+            if seq != self.seq:
+                raise OutOfSyncError( 'game %s is at seq %d, not %d' % (self.game_id, self.seq, seq))
+            self._apply( moves, undo)
+            if undo or moves:
+                self.seq += 1
+            self.last_used = time.time()
+            return self.seq, self.game_state, list( self.moves)
+
+    # The bot answered the position at seq. Play its move, unless
+    # the game has moved on in the meantime. Returns the new seq.
+    #-----------------------------------------------------------------
+    def play_answer( self, seq, move_str):
+        with self.lock:
+            if seq != self.seq:
+                raise OutOfSyncError( 'game %s changed while the bot was thinking' % self.game_id)
+            self._apply( [move_str])
+            self.seq += 1
+            return self.seq
+
+#======================
+class GameSessions:
+
+    # At most maxsize games, and at most max_states GameStates in all
+    # of them together. The least recently used games go first.
+    #--------------------------------------------------------------------
+    def __init__( self, maxsize=10000, ttl=3600, max_states=100000):
+        self.maxsize = maxsize
+        self.ttl = ttl # seconds without a move before we forget a game
+        self.max_states = max_states
+        self.lock = Lock()
+        self.games = OrderedDict() # game_id -> GameSession, least recently used first
+        self.n_states = 0
+
+    # Start a game, optionally with some moves already played.
+    # Raises IllegalMoveError if they don't make a game.
+    #------------------------------------------------------------
+    def new_game( self, board_size, moves=()):
+        session = GameSession( uuid.uuid4().hex, board_size)
+        session._apply( moves)
+        with self.lock:
+            self._reap()
+            session.owner = self
+            self.games[session.game_id] = session
+            self.n_states += session.n_states()
+            self._evict( session)
+        return session
+
+    # A game got longer or shorter. Caller holds the session's lock.
+    #-------------------------------------------------------------------
+    def _resized( self, session, delta):
+        with self.lock:
+            if self.games.get( session.game_id) is not session: # Evicted already
+                return
+            self.n_states += delta
+            self._evict( session)
+
+    # Forget a game. Caller holds the lock.
+    #-----------------------------------------
+    def _drop( self, game_id):
+        session = self.games.pop( game_id)
+        self.n_states -= session.n_states()
+
+    # Forget expired games, starting with the least recently used.
+    # Caller holds the lock.
+    #------------------------------------------------------------------
+    def _reap( self):
+        now = time.time()
+        while self.games:
+            game_id, session = next( iter( self.games.items()))
+            if now - session.last_used <= self.ttl:
+                break
+            self._drop( game_id)
+
+    # Forget the least recently used games until we are within bounds.
+    # The game keep is in use and stays. Caller holds the lock.
+    #----------------------------------------------------------------------
+    def _evict( self, keep):
+        while len(self.games) > self.maxsize or self.n_states > self.max_states:
+            victim = next( (gid for gid, s in self.games.items() if s is not keep), None)
+            if victim is None:
+                break
+            self._drop( victim)
+
+    # The session, or None if we don't know the game (anymore)
+    #--------------------------------------------------------------
+    def get( self, game_id):
+        with self.lock:
+            session = self.games.get( game_id)
+            if session is None:
+                return None
+            if time.time() - session.last_used > self.ttl:
+                self._drop( game_id)
+                return None
+            self.games.move_to_end( game_id)
+            return session
+
+    #--------------------
+    def __len__( self):
+        return len( self.games)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: gamestate_cache.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Replaying a game into a GameState costs a board copy per move.
+# Most requests share a long prefix with an earlier one: the same game
+# one move later, or a popular opening. We keep GameState snapshots
+# in a trie keyed by the moves, and replay only from the deepest
+# snapshot on the path. GameStates never change, so sharing them is safe.
+#
+
+from pdb import set_trace as BP
+from collections import OrderedDict
+from threading import Lock
+
+import goboard_fast as goboard
+from game_sessions import str_to_move
+
+# Print the stats every so many lookups
+STATS_EVERY = 100
+
+# One node per move. state is a snapshot, or None.
+#=====================================================
+class _Node:
+    __slots__ = ('parent', 'move', 'children', 'state')
+
+    #-----------------------------------
+    def __init__( self, parent, move):
+        self.parent = parent
+        self.move = move
+        self.children = {}
+        self.state = None
+
+#=========================
+class GameStateCache:
+
+    # Snapshots every snapshot_every moves, and at the end of every replay.
+    # A snapshot keeps its whole previous_state chain alive, so a snapshot
+    # at depth d counts as d+1 states. We keep at most max_states of those,
+    # least recently used snapshots go first. Chains shared between
+    # snapshots get counted more than once, so we never keep more.
+    #----------------------------------------------------------------------------
+    def __init__( self, max_states=20000, snapshot_every=8):
+        self.max_states = max_states
+        self.snapshot_every = snapshot_every
+        self.lock = Lock()
+        self.roots = {} # board_size -> _Node
+        self.lru = OrderedDict() # _Node -> None, nodes with a snapshot
+        self.n_states = 0 # states the snapshots keep alive, see above
+        self.n_lookups = 0
+        self.n_hits = 0
+        self.hit_depth = 0 # total over all lookups
+        self.replayed = 0 # moves we had to apply
+
+    # Same as replay_moves(), but starts from the deepest snapshot
+    #-----------------------------------------------------------------
+    def replay( self, board_size, moves):
+        keys = [m.upper() for m in moves]
+        with self.lock:
+            node, depth, state = self._deepest( board_size, keys)
+        if state is None:
+            state = goboard.GameState.new_game( board_size)
+        snaps = []
+        for idx in range( depth, len(moves)):
+            state = state.apply_move( str_to_move( moves[idx]))
+            if (idx + 1) % self.snapshot_every == 0 or idx + 1 == len(moves):
+                snaps.append( (idx + 1, state))
+        with self.lock:
+            self.n_lookups += 1
+            self.n_hits += depth > 0
+            self.hit_depth += depth
+            self.replayed += len(moves) - depth
+            for snap_depth, snap in snaps:
+                self._store( board_size, keys[:snap_depth], snap)
+        if self.n_lookups % STATS_EVERY == 0:
+            print( 'gamestate cache %s' % str(self.stats()))
+        return state
+
+    # Walk down the moves. Returns the deepest node with a snapshot,
+    # its depth, and the snapshot. Caller holds the lock.
+    #-------------------------------------------------------------------
+    def _deepest( self, board_size, keys):
+        best = (None, 0, None)
+        node = self.roots.get( board_size)
+        if node is None:
+            return best
+        for depth, key in enumerate( keys, 1):
+            node = node.children.get( key)
+            if node is None:
+                break
+            if node.state is not None:
+                best = (node, depth, node.state)
+        if best[0] is not None:
+            self.lru.move_to_end( best[0])
+        return best
+
+    # Remember a snapshot. Caller holds the lock.
+    #------------------------------------------------
+    def _store( self, board_size, keys, state):
+        node = self.roots.get( board_size)
+        if node is None:
+            node = self.roots[board_size] = _Node( None, None)
+        for key in keys:
+            child = node.children.get( key)
+            if child is None:
+                child = node.children[key] = _Node( node, key)
+            node = child
+        if node.state is not None:
+            self.n_states -= node.state.depth + 1
+        node.state = state
+        self.n_states += state.depth + 1
+        self.lru[node] = None
+        self.lru.move_to_end( node)
+        while self.n_states > self.max_states:
+            old, _ = self.lru.popitem( last=False)
+            self.n_states -= old.state.depth + 1
+            old.state = None
+            self._prune( old)
+
+    # Remove nodes that lead to no snapshot anymore
+    #--------------------------------------------------
+    def _prune( self, node):
+        while node.parent is not None and not node.children and node.state is None:
+            del node.parent.children[node.move]
+            node = node.parent
+
+    #-------------------
+    def stats( self):
+        with self.lock:
+            n = self.n_lookups
+            return { 'positions': len(self.lru),
+                     'states': self.n_states,
+                     'lookups': n,
+                     'hit_rate': self.n_hits / n if n else 0.0,
+                     'avg_hit_depth': self.hit_depth / n if n else 0.0,
+                     'avg_replayed': self.replayed / n if n else 0.0 }
@@ -11,6 +11,7 @@
 
 from pdb import set_trace as BP
 import os
+import json
 import numpy as np
 from datetime import datetime
 
@@ -20,20 +21,174 @@ from flask import Flask
 #from flask_cors import CORS
 from flask import jsonify
 from flask import request
+from flask import Response
+from contextlib import contextmanager
 
 from gotypes import Player, Point
 from go_utils import print_board, print_move
 import goboard_fast as goboard
+import zobrist
 from go_utils import coords_from_point, point_from_coords
+from playout_scheduler import DeadlineExceededError
+from single_flight import SingleFlight
+from game_sessions import GameSessions, OutOfSyncError, replay_moves, game_state_for, position_key
+from game_sessions import fits_position, str_to_move
+from gamestate_cache import GameStateCache
+from cancel_token import CancelToken, DisconnectWatcher, LatestRequests, RequestCancelledError
+import cancel_token
+
+# Most positions per /analyze-batch request
+MAX_BATCH = 1000
+
+# Is this a list of move strings
+#----------------------------------
+def _is_move_list( moves):
+    return isinstance( moves, list) and all( isinstance( m, str) for m in moves)
+
+# Turn a bot's Move into a string like 'D4' or 'pass'
+#------------------------------------------------------
+def move_to_str( bot_move):
+    if bot_move is None or bot_move.is_pass:
+        return 'pass'
+    elif bot_move.is_resign:
+        return 'resign'
+    return coords_from_point( bot_move.point)
+
+# Look the position up in the opening book.
+# Returns (bot_move_str, diagnostics), or None if it's not in the book.
+# Clients can say config['book'] = False to skip the book.
+# With n_moves, positions deeper than the book don't need a board.
+#-----------------------------------------------------------------------
+def book_move( book, game_state, config, n_moves=None):
+    if book is None or not config.get( 'book', True):
+        return None
+    if n_moves is not None and not book.covers( n_moves):
+        return None
+    hit = book.choose( game_state, config.get( 'randomness', 0.0))
+    if hit is None:
+        return None
+    move_str, winrate = hit
+    # Book winrates are for the side to move, diagnostics want black's
+    winprob = winrate if game_state.next_player == Player.black else 1 - winrate
+    return move_str, { 'winprob': winprob, 'book': True }
+
+# Requests with the same key can share one bot answer.
+# None if the answer should be random. The key has the ko point,
+# but not the superko history. Check shared answers with shared_fits().
+#---------------------------------------------------------
+def coalesce_key( bot_name, game_state, config):
+    if config.get( 'randomness', 0.0):
+        return None
+    # request_id and game_id don't change the answer
+    settings = json.dumps( { k:v for k,v in config.items() if k not in ('request_id', 'game_id') },
+                           sort_keys=True)
+    return ( bot_name, position_key( game_state), settings )
+
+# Can this request use an answer shared under coalesce_key()
+#--------------------------------------------------------------
+def shared_fits( game_state, bot_move_str):
+    return fits_position( game_state, str_to_move( bot_move_str))
+
+# Tell the client we dropped the request because of load.
+# For games on the server, seq is where the game is now.
+#----------------------------------------------------------
+def shed_response( err, config, seq=None):
+    print( 'shed request: %s' % str(err))
+    res = {
+        'status': 'shed',
+        'error': str(err),
+        'request_id': config.get('request_id','')
+    }
+    if seq is not None:
+        res['seq'] = seq
+    return jsonify( res), 503
+
+# Tell the client we gave up on the request, because a newer
+# one for the same game came in, or because they hung up.
+# For games on the server, seq is where the game is now.
+#---------------------------------------------------------------
+def cancelled_response( err, config, seq=None):
+    print( 'cancelled request: %s' % str(err))
+    res = {
+        'status': 'cancelled',
+        'error': str(err),
+        'request_id': config.get('request_id','')
+    }
+    if seq is not None:
+        res['seq'] = seq
+    return jsonify( res), 409
+
+# The client's socket, so we can tell when they hang up
+#---------------------------------------------------------
+def client_socket( environ):
+    return environ.get( 'gunicorn.socket') or environ.get( 'werkzeug.socket')
+
+# One server-sent event
+#---------------------------------
+def sse_event( data, event=None):
+    res = 'event: %s\n' % event if event else ''
+    return res + 'data: %s\n\n' % json.dumps( data)
 
 # Return a flask app that will ask the specified bot for a move.
-#-----------------------------------------------------------------
-def get_bot_app( bot_map):
+# If there is an opening book, we try that before asking the bot.
+# Identical concurrent requests share one answer from the bot.
+# Requests get cancelled if the client hangs up, or if a newer
+# request comes in with the same config['game_id'].
+# Clients can also keep their game on the server, with /game/new,
+# and then only send new moves.
+# Replays start from the deepest GameState in game_states we have seen.
+#-------------------------------------------------------------------------
+def get_bot_app( bot_map, book=None, game_states=None):
+    if game_states is None:
+        game_states = GameStateCache()
+    in_flight = SingleFlight()
+    watcher = DisconnectWatcher()
+    latest = LatestRequests()
+    sessions = GameSessions()
+
+    @contextmanager
+    # with cancellable( config, what) as token: ...
+    # what says what the request is about, usually the moves.
+    #-----------------------------------------------------------
+    def cancellable( config, what):
+        token = CancelToken()
+        game_id = config.get( 'game_id')
+        watcher.watch( client_socket( request.environ), token)
+        latest.start( game_id, what, token)
+        try:
+            yield token
+        finally:
+            watcher.unwatch( token)
+            latest.finish( game_id, token)
 
     here = os.path.dirname( __file__)
     static_path = os.path.join( here, 'static')
     app = Flask( __name__, static_folder=static_path, static_url_path='/static')
 
+    # Book move, or ask the bot. Returns (bot_move_str, diagnostics).
+    # Raises DeadlineExceededError or RequestCancelledError.
+    #--------------------------------------------------------------------
+    def bot_answer( bot_name, game_state, moves, config):
+        from_book = book_move( book, game_state, config, len(moves))
+        if from_book:
+            return from_book
+        bot_agent = bot_map[bot_name]
+        # Diagnostics must come from the same thread as the move
+        #------------------------------------------------------------
+        def ask_bot():
+            bot_move = bot_agent.select_move( game_state, moves, config)
+            return move_to_str( bot_move), bot_agent.diagnostics()
+        key = coalesce_key( bot_name, game_state, config)
+        with cancellable( config, (bot_name, tuple( moves))) as token:
+            if key is None:
+                with cancel_token.use( token):
+                    return ask_bot()
+            res = in_flight.do( key, ask_bot, token)
+            if shared_fits( game_state, res[0]):
+                return res
+            with cancel_token.use( token): # Illegal here, ask for ourselves
+                return ask_bot()
+
     @app.route('/select-move/<bot_name>', methods=['POST'])
     # Ask the named bot for the next move
     #--------------------------------------
@@ -42,31 +197,200 @@ def get_bot_app( bot_map):
         content = request.json
         print( '>>> %s select move %s %s' % (dtstr, bot_name, str(content.get('config',{}))))
         board_size = content['board_size']
-        game_state = goboard.GameState.new_game( board_size)
-        # Replay the game up to this point.
-        for move in content['moves']:
-            if move == 'pass':
-                next_move = goboard.Move.pass_turn()
-            elif move == 'resign':
-                next_move = goboard.Move.resign()
-            else:
-                next_move = goboard.Move.play( point_from_coords(move))
-            game_state = game_state.apply_move( next_move)
-            #print_board( game_state.board)
-        bot_agent = bot_map[bot_name]
+        # Replay the game up to this point, if the bot wants a board
+        game_state = game_state_for( bot_map[bot_name], board_size, content['moves'], game_states.replay)
         config = content.get('config',{})
-        bot_move = bot_agent.select_move( game_state, content['moves'], config)
-        if bot_move is None or bot_move.is_pass:
-            bot_move_str = 'pass'
-        elif bot_move.is_resign:
-            bot_move_str = 'resign'
-        else:
-            bot_move_str = coords_from_point( bot_move.point)
-        diag =  bot_agent.diagnostics()
+        try:
+            bot_move_str, diag = bot_answer( bot_name, game_state, content['moves'], config)
+        except DeadlineExceededError as e:
+            return shed_response( e, config)
+        except RequestCancelledError as e:
+            return cancelled_response( e, config)
         return jsonify({
             'bot_move': bot_move_str,
             'diagnostics': diag,
             'request_id': config.get('request_id','') # echo request_id
         })
 
+    @app.route('/game/new', methods=['POST'])
+    # Start a game on the server. Optional 'moves' are already played.
+    # Returns the game_id and seq for the next request.
+    #----------------------------------------------------------------------
+    def new_game():
+        content = request.json
+        board_size = content.get( 'board_size', 19)
+        if type( board_size) is not int or not 2 <= board_size <= zobrist.MAX_SIZE:
+            return jsonify( { 'status': 'bad_request', 'error': 'board_size must be an int up to %d' % zobrist.MAX_SIZE }), 400
+        if not _is_move_list( content.get( 'moves', [])):
+            return jsonify( { 'status': 'bad_request', 'error': 'moves must be a list of moves' }), 400
+        try:
+            session = sessions.new_game( board_size, content.get( 'moves', []))
+        except goboard.IllegalMoveError as e:
+            return jsonify( { 'status': 'illegal_move', 'error': str(e) }), 400
+        print( '>>> new game %s, %d games' % (session.game_id, len(sessions)))
+        return jsonify( { 'game_id': session.game_id, 'seq': session.seq })
+
+    # Find the game and apply the client's change.
+    # Returns (session, seq, game_state, moves) or an error response.
+    #-------------------------------------------------------------------
+    def update_game( game_id, content):
+        session = sessions.get( game_id)
+        if session is None:
+            return None, jsonify( { 'status': 'unknown_game', 'error': 'no game %s' % game_id }), 404
+        new_moves = content.get( 'moves', [])
+        undo = content.get( 'undo', 0)
+        # bool is an int too
+        if type( content.get( 'seq')) is not int or type( undo) is not int or undo < 0 or not _is_move_list( new_moves):
+            return None, jsonify( { 'status': 'bad_request', 'error': 'need an int seq, an int undo >= 0, and a list of moves',
+                                    'seq': session.seq }), 400
+        try:
+            seq, game_state, moves = session.update( content['seq'], new_moves, undo)
+        except OutOfSyncError as e:
+            return None, jsonify( { 'status': 'out_of_sync', 'error': str(e), 'seq': session.seq }), 409
+        except goboard.IllegalMoveError as e: # Nothing changed
+            return None, jsonify( { 'status': 'illegal_move', 'error': str(e), 'seq': session.seq }), 400
+        return session, seq, game_state, moves
+
+    @app.route('/game/<game_id>/moves', methods=['POST'])
+    # {'seq':n, 'moves':[new moves], 'undo':k} takes back k moves,
+    # then plays the new ones. Returns the new seq.
+    #-----------------------------------------------------------------
+    def game_moves( game_id):
+        res = update_game( game_id, request.json)
+        if res[0] is None:
+            return res[1:]
+        session, seq, game_state, moves = res
+        return jsonify( { 'seq': seq })
+
+    @app.route('/game/<game_id>/select-move/<bot_name>', methods=['POST'])
+    # Same as /game/<game_id>/moves, then the bot plays its move.
+    # Returns the bot move, diagnostics, and the seq after the bot move.
+    #----------------------------------------------------------------------
+    def game_select_move( game_id, bot_name):
+        content = request.json
+        config = dict( content.get('config',{}))
+        config.setdefault( 'game_id', game_id)
+        res = update_game( game_id, content)
+        if res[0] is None:
+            return res[1:]
+        session, seq, game_state, moves = res
+        print( '>>> game %s select move %s at move %d' % (game_id, bot_name, len(moves)))
+        try:
+            bot_move_str, diag = bot_answer( bot_name, game_state, moves, config)
+            seq = session.play_answer( seq, bot_move_str)
+        except DeadlineExceededError as e:
+            return shed_response( e, config, session.seq)
+        except RequestCancelledError as e:
+            return cancelled_response( e, config, session.seq)
+        except OutOfSyncError as e:
+            return jsonify( { 'status': 'out_of_sync', 'error': str(e), 'seq': session.seq }), 409
+        return jsonify({
+            'bot_move': bot_move_str,
+            'diagnostics': diag,
+            'seq': seq,
+            'request_id': config.get('request_id','')
+        })
+
+    @app.route('/analyze/<bot_name>', methods=['POST'])
+    # Stream the named bot's analysis as server-sent events.
+    # Every event has the candidate moves, best first, with visits,
+    # winrate and lcb for the side to move, and the principal variation.
+    # config can have max_visits, max_seconds, interval_ms.
+    #------------------------------------------------------------------
+    def analyze( bot_name):
+        content = request.json
+        bot_agent = bot_map[bot_name]
+        if not hasattr( bot_agent, 'analyze'):
+            return jsonify( {'error': '%s does not analyze' % bot_name}), 404
+        moves = content['moves']
+        config = content.get('config',{})
+        print( '>>> analyze %s %d moves %s' % (bot_name, len(moves), str(config)))
+        to_move = 'b' if len(moves) % 2 == 0 else 'w'
+        token = CancelToken()
+        game_id = config.get( 'game_id')
+
+        # If the client disconnects, the server closes this generator,
+        # which closes reports, which stops the engine.
+        # We only register in here, where the finally cleans up. If the
+        # response never gets iterated, there is nothing to clean up.
+        #-----------------------------------------------------------------
+        def events():
+            visits = 0
+            # A newer request for the same game stops this one
+            latest.start( game_id, ('analyze', bot_name, tuple( moves)), token)
+            reports = None
+            try:
+                reports = bot_agent.analyze( moves,
+                                             config.get( 'max_visits', 1000),
+                                             config.get( 'max_seconds', 10.0),
+                                             max( 1, config.get( 'interval_ms', 500) // 10),
+                                             token)
+                for cands in reports:
+                    visits = sum( [c['visits'] for c in cands])
+                    yield sse_event( { 'to_move': to_move, 'visits': visits, 'candidates': cands })
+                yield sse_event( { 'visits': visits }, 'done')
+            except Exception as e:
+                print( 'error: analyze: %s' % str(e))
+                yield sse_event( { 'error': str(e) }, 'error')
+            finally:
+                if reports is not None:
+                    reports.close()
+                latest.finish( game_id, token)
+
+        return Response( events(), mimetype='text/event-stream',
+                         headers={ 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no' })
+
+    @app.route('/analyze-batch/<bot_name>', methods=['POST'])
+    # Ask the named bot for a move in many positions, in one request.
+    # Either {'moves':[...], 'plies':[0,1,2...]} for positions in one game,
+    # where ply n is the position after the first n moves,
+    # or {'positions':[[...],[...]...]} with one move list per position.
+    # For each position we return bot_move, black's winprob, and visits.
+    #------------------------------------------------------------------------
+    def analyze_batch( bot_name):
+        content = request.json
+        bot_agent = bot_map[bot_name]
+        if not hasattr( bot_agent, 'genmove_batch'):
+            return jsonify( {'error': '%s does not do batches' % bot_name}), 404
+        config = content.get('config',{})
+        if 'positions' in content:
+            positions = content['positions']
+            if not isinstance( positions, list) or not all( _is_move_list( p) for p in positions):
+                return jsonify( {'error': 'positions must be a list of move lists'}), 400
+            plies = [ len(moves) for moves in positions ]
+        else:
+            moves = content.get( 'moves')
+            if not _is_move_list( moves):
+                return jsonify( {'error': 'moves must be a list of moves'}), 400
+            plies = content.get( 'plies', list( range( len(moves) + 1)))
+            # bool is an int too
+            if not isinstance( plies, list) or not all( type(p) is int for p in plies):
+                return jsonify( {'error': 'plies must be a list of ints'}), 400
+            plies = sorted( set( plies))
+            if plies and (plies[0] < 0 or plies[-1] > len(moves)):
+                return jsonify( {'error': 'ply out of range'}), 400
+            positions = [ moves[:ply] for ply in plies ]
+        if len(positions) > MAX_BATCH:
+            return jsonify( {'error': 'at most %d positions per batch' % MAX_BATCH}), 400
+        print( '>>> analyze batch %s %d positions %s' % (bot_name, len(positions), str(config)))
+        results = []
+        try:
+            with cancellable( config, ('batch', bot_name, tuple( plies), tuple( map( tuple, positions)))) as token:
+                with cancel_token.use( token):
+                    answers = bot_agent.genmove_batch( positions, config.get( 'playouts', 0))
+        except RequestCancelledError as e:
+            return cancelled_response( e, config)
+        for ply, (bot_move, win_prob, visits) in zip( plies, answers):
+            if bot_move is None:
+                results.append( { 'ply': ply, 'error': 'no answer' })
+                continue
+            # Leela's winprob is for the side to move
+            winprob = float(win_prob) if ply % 2 == 0 else 1 - float(win_prob)
+            results.append( { 'ply': ply, 'bot_move': move_to_str( bot_move),
+                              'winprob': winprob, 'visits': visits })
+        return jsonify({
+            'results': results,
+            'request_id': config.get('request_id','')
+        })
+
     return app
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# /********************************************************************
+# Filename: get_bot_app_async.py
+# Author: AHN
+# Creation Date: Apr, 2019
+# **********************************************************************/
+#
+# asyncio variant of get_bot_app, on Quart (Flask API on asyncio).
+# Bots with a coroutine select_move() are awaited on the event loop.
+# Plain bots run in a thread pool.
+# Serve with e.g.  hypercorn leela_server_async:app --bind 0.0.0.0:2718
+#
+
+from pdb import set_trace as BP
+import os
+import asyncio
+import inspect
+from datetime import datetime
+
+from quart import Quart
+from quart import jsonify
+from quart import request
+
+from get_bot_app import move_to_str, book_move, coalesce_key, shared_fits
+from game_sessions import game_state_for
+from gamestate_cache import GameStateCache
+from playout_scheduler import DeadlineExceededError
+from single_flight import AsyncSingleFlight
+
+# Return a quart app that will ask the specified bot for a move.
+# Bots with start() and stop() coroutines get started before serving
+# and stopped after. If there is an opening book, we try that first.
+# Identical concurrent requests share one answer from the bot.
+# Replays start from the deepest GameState in game_states we have seen.
+#---------------------------------------------------------------------
+def get_bot_app_async( bot_map, book=None, game_states=None):
+    if game_states is None:
+        game_states = GameStateCache()
+    in_flight = AsyncSingleFlight()
+
+    here = os.path.dirname( __file__)
+    static_path = os.path.join( here, 'static')
+    app = Quart( __name__, static_folder=static_path, static_url_path='/static')
+
+    @app.before_serving
+    #--------------------------
+    async def start_bots():
+        for bot_agent in bot_map.values():
+            if inspect.iscoroutinefunction( getattr( bot_agent, 'start', None)):
+                await bot_agent.start()
+
+    @app.after_serving
+    #--------------------------
+    async def stop_bots():
+        for bot_agent in bot_map.values():
+            if inspect.iscoroutinefunction( getattr( bot_agent, 'stop', None)):
+                await bot_agent.stop()
+
+    @app.route('/select-move/<bot_name>', methods=['POST'])
+    # Ask the named bot for the next move
+    #--------------------------------------
+    async def select_move( bot_name):
+        dtstr = datetime.strftime(datetime.now(),'%Y-%m-%d %H:%M:%S')
+        content = await request.get_json()
+        print( '>>> %s select move %s %s' % (dtstr, bot_name, str(content.get('config',{}))))
+        board_size = content['board_size']
+        bot_agent = bot_map[bot_name]
+        config = content.get('config',{})
+
+        # Replay the game up to this point, if the bot wants a board.
+        # Then the book, which needs a board if the book is deep enough.
+        #-------------------------------------------------------------------
+        def prepare():
+            game_state = game_state_for( bot_agent, board_size, content['moves'], game_states.replay)
+            return game_state, book_move( book, game_state, config, len( content['moves']))
+
+        # A replay would block the event loop for everybody
+        may_replay = getattr( bot_agent, 'needs_game_state', True) or \
+            (book is not None and config.get( 'book', True) and book.covers( len( content['moves'])))
+        if may_replay:
+            game_state, from_book = await asyncio.get_running_loop().run_in_executor( None, prepare)
+        else:
+            game_state, from_book = prepare()
+
+        # Diagnostics must come from the same task or thread as the move
+        #-------------------------------------------------------------------
+        async def ask_bot():
+            if inspect.iscoroutinefunction( bot_agent.select_move):
+                bot_move = await bot_agent.select_move( game_state, content['moves'], config)
+                return move_to_str( bot_move), bot_agent.diagnostics()
+            #------------------
+            def run_bot():
+                return move_to_str( bot_agent.select_move( game_state, content['moves'], config)), bot_agent.diagnostics()
+            return await asyncio.get_running_loop().run_in_executor( None, run_bot)
+
+        try:
+            if from_book:
+                bot_move_str, diag = from_book
+            else:
+                key = coalesce_key( bot_name, game_state, config)
+                if key is None:
+                    bot_move_str, diag = await ask_bot()
+                else:
+                    bot_move_str, diag = await in_flight.do( key, ask_bot)
+                    if not shared_fits( game_state, bot_move_str): # Illegal here, ask for ourselves
+                        bot_move_str, diag = await ask_bot()
+        except DeadlineExceededError as e:
+            print( 'shed request: %s' % str(e))
+            return jsonify({
+                'status': 'shed',
+                'error': str(e),
+                'request_id': config.get('request_id','')
+            }), 503
+        return jsonify({
+            'bot_move': bot_move_str,
+            'diagnostics': diag,
+            'request_id': config.get('request_id','') # echo request_id
+        })
+
+    return app
@@ -61,19 +61,45 @@ def coords_from_point(point):
 def p2idx(point, boardsize):
     return (point.row-1)*boardsize + point.col - 1
 
-#==================
+# How many stones went down since the stone on a point was placed,
+# -1 if the point is empty. We keep the move number at which each stone
+# was placed, and subtract on read. The array gets allocated on the first
+# stone, and copies share it until one of them writes.
+#==========================================================================
 class MoveAge():
     def __init__(self, board):
-        self.move_ages = - np.ones((board.num_rows, board.num_cols))
+        self.shape = (board.num_rows, board.num_cols)
+        self.move = 0 # stones placed so far
+        self.stamps = None # move number of the stone on each point, -1 if empty
+        self.shared = False
+
+    def copy(self):
+        res = MoveAge.__new__(MoveAge)
+        res.shape = self.shape
+        res.move = self.move
+        res.stamps = self.stamps
+        res.shared = self.shared = self.stamps is not None
+        return res
+
+    def _writable(self):
+        if self.stamps is None:
+            self.stamps = np.full(self.shape, -1, dtype=np.int32)
+        elif self.shared:
+            self.stamps = self.stamps.copy()
+            self.shared = False
+        return self.stamps
 
     def get(self, row, col):
-        return self.move_ages[row, col]
+        if self.stamps is None:
+            return -1
+        stamp = self.stamps[row, col]
+        return -1 if stamp < 0 else self.move - stamp
 
     def reset_age(self, point):
-        self.move_ages[point.row - 1, point.col - 1] = -1
+        self._writable()[point.row - 1, point.col - 1] = -1
 
     def add(self, point):
-        self.move_ages[point.row - 1, point.col - 1] = 0
+        self._writable()[point.row - 1, point.col - 1] = self.move
 
     def increment_all(self):
-        self.move_ages[self.move_ages > -1] += 1
+        self.move += 1
@@ -2,10 +2,14 @@
 from pdb import set_trace as BP
 
 import copy
+import numpy as np
+from array import array
+from threading import Lock
 from gotypes import Player, Point
 import scoring
 import zobrist
 from go_utils import MoveAge
+from agent_helpers import is_point_an_eye
 
 #__all__ = [
 #    'Board',
@@ -169,10 +173,8 @@ class Board():
             new_string = new_string.merged_with( same_color_string)
         for new_string_point in new_string.stones:
             self._grid[new_string_point] = new_string
-        # Remove empty-point hash code.
-        self._hash ^= zobrist.HASH_CODE[point, None]
-        # Add filled point hash code.
-        self._hash ^= zobrist.HASH_CODE[point, player]
+        # Empty point becomes filled point.
+        self._hash ^= zobrist.stone_code( point, player)
 
         # 2. Reduce liberties of any adjacent strings of the opposite
         #    color.
@@ -202,10 +204,8 @@ class Board():
                 if neighbor_string is not string:
                     self._replace_string( neighbor_string.with_liberty( point))
             self._grid[point] = None
-            # Remove filled point hash code.
-            self._hash ^= zobrist.HASH_CODE[point, string.color]
-            # Add empty point hash code.
-            self._hash ^= zobrist.HASH_CODE[point, None]
+            # Filled point becomes empty point.
+            self._hash ^= zobrist.stone_code( point, string.color)
 
     #-------------------------------------
     def strings_in_atari( self, player):
@@ -251,6 +251,44 @@ class Board():
                     return True
         return False
 
+    # The hash after player plays at point, without playing
+    #-----------------------------------------------------------
+    def hash_after( self, player, point):
+        res = self._hash ^ zobrist.stone_code( point, player)
+        captured = []
+        for neighbor in self.neighbor_table[point]:
+            neighbor_string = self._grid.get( neighbor)
+            if neighbor_string is None or neighbor_string.color == player:
+                continue
+            if neighbor_string.num_liberties == 1 and neighbor_string not in captured:
+                captured.append( neighbor_string)
+                for stone in neighbor_string.stones:
+                    res ^= zobrist.stone_code( stone, neighbor_string.color)
+        return res
+
+    # Board does not track ko. The hash check catches it.
+    #--------------------------------------------------------
+    def is_simple_ko( self, player, point):
+        return False
+
+    # Same as ArrayBoard.ko_point()
+    #---------------------------------
+    def ko_point( self, player):
+        return None
+
+    # Same as ArrayBoard.move_masks(), one point at a time
+    #---------------------------------------------------------
+    def move_masks( self, player, exclude_own_eyes=False):
+        legal = np.zeros( (self.num_rows, self.num_cols), dtype=bool)
+        captures = np.zeros( (self.num_rows, self.num_cols), dtype=bool)
+        for point in self.neighbor_table:
+            if self._grid.get( point) is not None: continue
+            if self.is_self_capture( player, point): continue
+            if exclude_own_eyes and is_point_an_eye( self, point, player): continue
+            legal[point.row - 1, point.col - 1] = True
+            captures[point.row - 1, point.col - 1] = self.will_capture( player, point)
+        return legal, captures
+
     #------------------------------
     def is_on_grid( self, point):
         return 1 <= point.row <= self.num_rows and \
@@ -301,6 +339,7 @@ class Board():
         # (immutable) to GoStrings (also immutable)
         copied._grid = copy.copy( self._grid)
         copied._hash = self._hash
+        copied.move_ages = self.move_ages.copy()
         return copied
 
 # tag::return_zobrist[]
@@ -309,6 +348,400 @@ class Board():
         return self._hash
 # end::return_zobrist[]
 
+# ArrayBoard color values to Player. Empty is 0.
+COLORS = (None, Player.black, Player.white)
+# Color of the points around the board in move_masks()
+OFF_BOARD = 3
+
+array_tables = {}
+
+# The Point for each flat index, and the neighbor indices of each index
+#------------------------------------------------------------------------
+def init_array_tables( dim):
+    rows, cols = dim
+    if dim not in neighbor_tables:
+        init_neighbor_table( dim)
+    points = [ Point( row=r, col=c) for r in range( 1, rows + 1) for c in range( 1, cols + 1) ]
+    nbrs = [ [ (n.row - 1) * cols + n.col - 1 for n in neighbor_tables[dim][p] ] for p in points ]
+    array_tables[dim] = (points, nbrs)
+
+# Same interface as Board, but the position lives in flat arrays indexed
+# by (row-1) * num_cols + col-1. A string is identified by the index of
+# one of its stones. Every stone knows its string id, the stones of a string
+# form a circular list, and the string id holds the liberty count.
+# Nothing gets rebuilt on a merge or capture, and a copy is a few memcpys.
+# GoStrings get built on demand by get_go_string() and friends.
+# For search, play() and undo() change the board in place.
+#==============================================================================
+class ArrayBoard():
+
+    #----------------------------------------
+    def __init__( self, num_rows, num_cols):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        n = num_rows * num_cols
+        self._color = array( 'b', [0]) * n # Player.value, or 0 if empty
+        self._string = array( 'h', [-1]) * n # String id, -1 if empty
+        self._next = array( 'h', range( n)) # Next stone in the same string
+        self._size = array( 'h', [0]) * n # Stones in the string, for string ids
+        self._libs = array( 'h', [0]) * n # Liberties of the string, for string ids
+        self._hash = zobrist.EMPTY_BOARD
+        self._ko = None # (point index, color of the capturer) after a ko capture
+        self._trail = [] # (array, index, old value) for undo()
+        self._marks = [] # (trail length, hash, ko) before each play()
+
+        dim = (num_rows, num_cols)
+        if dim not in array_tables:
+            init_array_tables( dim)
+        if dim not in corner_tables:
+            init_corner_table( dim)
+        self.neighbor_table = neighbor_tables[dim]
+        self.corner_table = corner_tables[dim]
+        self._points, self._nbrs = array_tables[dim]
+        self._codes = zobrist.stone_codes( num_rows, num_cols) # idx * 3 + color
+        self.move_ages = MoveAge( self)
+
+    #---------------------------
+    def neighbors( self, point):
+        return self.neighbor_table[point]
+
+    #---------------------------
+    def corners( self, point):
+        return self.corner_table[point]
+
+    #--------------------------
+    def _idx( self, point):
+        return (point.row - 1) * self.num_cols + point.col - 1
+
+    # Indices of the stones in a string
+    #-------------------------------------
+    def _stones( self, sid):
+        res = [sid]
+        idx = self._next[sid]
+        while idx != sid:
+            res.append( idx)
+            idx = self._next[idx]
+        return res
+
+    # Indices of the liberties of a string
+    #----------------------------------------
+    def _liberties( self, sid):
+        color = self._color
+        return { nb for idx in self._stones( sid) for nb in self._nbrs[idx] if not color[nb] }
+
+    # Write arr[idx]. Log the old value while there is a play() to undo.
+    #-----------------------------------------------------------------------
+    def _set( self, arr, idx, val):
+        if self._marks:
+            self._trail.append( (arr, idx, arr[idx]))
+        arr[idx] = val
+
+    # Relabel string other as part of string sid
+    #-----------------------------------------------
+    def _join( self, sid, other):
+        for idx in self._stones( other):
+            self._set( self._string, idx, sid)
+        nxt = self._next[sid]
+        self._set( self._next, sid, self._next[other])
+        self._set( self._next, other, nxt)
+        self._set( self._size, sid, self._size[sid] + self._size[other])
+
+    #-------------------------------------
+    def place_stone( self, player, point):
+        self.move_ages.increment_all()
+        self.move_ages.add( point)
+        for idx in self._place( player, point):
+            self.move_ages.reset_age( self._points[idx])
+
+    # Place a stone, and remember how to take it back with undo().
+    # For search. Move ages don't change.
+    #-----------------------------------------------------------------
+    def play( self, player, point):
+        self._marks.append( (len(self._trail), self._hash, self._ko))
+        self._place( player, point)
+
+    # Take back the last play()
+    #-----------------------------
+    def undo( self):
+        n, self._hash, self._ko = self._marks.pop()
+        trail = self._trail
+        while len(trail) > n:
+            arr, idx, val = trail.pop()
+            arr[idx] = val
+
+    # Put the stone down, merge, capture. Returns the captured indices.
+    #---------------------------------------------------------------------
+    def _place( self, player, point):
+        assert self.is_on_grid( point)
+        idx = self._idx( point)
+        if self._color[idx]:
+            print( 'Illegal play on %s' % str(point))
+        assert not self._color[idx]
+        color = player.value
+        nbrs = self._nbrs[idx]
+        colors = self._color
+        strings = self._string
+        # 0. Examine the adjacent points.
+        same = []
+        opposite = []
+        n_empty = 0
+        for nb in nbrs:
+            nbcolor = colors[nb]
+            if not nbcolor:
+                n_empty += 1
+                continue
+            sid = strings[nb]
+            if nbcolor == color:
+                if sid not in same: same.append( sid)
+            elif sid not in opposite:
+                opposite.append( sid)
+        self._set( colors, idx, color)
+        self._set( strings, idx, idx)
+        self._set( self._next, idx, idx)
+        self._set( self._size, idx, 1)
+        self._hash ^= self._codes[idx * 3 + color]
+
+        # 1. Merge any adjacent strings of the same color.
+        if not same:
+            self._set( self._libs, idx, n_empty)
+        elif len(same) == 1:
+            # Lose the liberty at point, gain the empty neighbors
+            # the string did not touch yet
+            sid = same[0]
+            self._join( sid, idx)
+            gained = 0
+            for nb in nbrs:
+                if colors[nb]: continue
+                for x in self._nbrs[nb]:
+                    if x != idx and strings[x] == sid: break
+                else:
+                    gained += 1
+            self._set( self._libs, sid, self._libs[sid] + gained - 1)
+        else:
+            sid = max( same, key=lambda s: self._size[s])
+            self._join( sid, idx)
+            for other in same:
+                if other != sid:
+                    self._join( sid, other)
+            self._set( self._libs, sid, len( self._liberties( sid)))
+
+        # 2. Reduce liberties of any adjacent strings of the opposite
+        #    color.
+        # 3. If any opposite color strings now have zero liberties,
+        #    remove them.
+        captured = []
+        for sid in opposite:
+            self._set( self._libs, sid, self._libs[sid] - 1)
+            if not self._libs[sid]:
+                captured += self._remove_string( sid)
+
+        # A lone stone that took a lone stone and has one liberty:
+        # taking it right back would repeat the position.
+        if len(captured) == 1 and self._size[strings[idx]] == 1 and self._libs[idx] == 1:
+            self._ko = (captured[0], color)
+        else:
+            self._ko = None
+        return captured
+
+    # Take a string off the board. Returns its stone indices.
+    #-----------------------------------------------------------
+    def _remove_string( self, sid):
+        color = self._color[sid]
+        stones = self._stones( sid)
+        for idx in stones:
+            self._set( self._color, idx, 0)
+            self._set( self._string, idx, -1)
+            self._set( self._next, idx, idx)
+            # Filled point becomes empty point.
+            self._hash ^= self._codes[idx * 3 + color]
+        # Removing a string can create liberties for other strings.
+        for idx in stones:
+            seen = []
+            for nb in self._nbrs[idx]:
+                other = self._string[nb]
+                if other >= 0 and other not in seen:
+                    seen.append( other)
+                    self._set( self._libs, other, self._libs[other] + 1)
+        return stones
+
+    # Build a GoString from a string id
+    #-------------------------------------
+    def _go_string( self, sid):
+        points = self._points
+        return GoString( COLORS[self._color[sid]],
+                         [ points[idx] for idx in self._stones( sid) ],
+                         [ points[idx] for idx in self._liberties( sid) ])
+
+    #-------------------------------------
+    def strings_in_atari( self, player):
+        return self.strings_with_liberties( player, 1)
+
+    #---------------------------------------------
+    def strings_with_liberties( self, player, n):
+        color = player.value
+        return { self._go_string( sid) for sid in range( len(self._color))
+                 if self._string[sid] == sid and self._color[sid] == color and self._libs[sid] == n }
+
+    # The hash after player plays at point, without playing.
+    # XOR in the stone, XOR out whatever it captures.
+    #-----------------------------------------------------------
+    def hash_after( self, player, point):
+        color = player.value
+        codes = self._codes
+        res = self._hash ^ codes[self._idx( point) * 3 + color]
+        captured = []
+        for nb in self._nbrs[self._idx( point)]:
+            nbcolor = self._color[nb]
+            if not nbcolor or nbcolor == color:
+                continue
+            sid = self._string[nb]
+            if self._libs[sid] == 1 and sid not in captured:
+                captured.append( sid)
+                for stone in self._stones( sid):
+                    res ^= codes[stone * 3 + nbcolor]
+        return res
+
+    # Would player retake a ko right away
+    #----------------------------------------
+    def is_simple_ko( self, player, point):
+        return self._ko is not None and \
+            self._ko[0] == self._idx( point) and \
+            self._ko[1] != player.value
+
+    # The board index player may not retake right now, or None.
+    # Two positions with the same stones can differ in this.
+    #-------------------------------------------------------------
+    def ko_point( self, player):
+        if self._ko is None or self._ko[1] == player.value:
+            return None
+        return self._ko[0]
+
+    # Where can player play, ignoring ko, and which of those moves capture.
+    # Two boolean arrays of board shape, computed for the whole board at once.
+    # With exclude_own_eyes, player's eyes don't count as playable.
+    #------------------------------------------------------------------------------
+    def move_masks( self, player, exclude_own_eyes=False):
+        rows, cols = self.num_rows, self.num_cols
+        color = player.value
+        other = player.other.value
+        # Pad with a border, so every point has four neighbors and four corners
+        colors = np.full( (rows + 2, cols + 2), OFF_BOARD, dtype=np.int8)
+        colors[1:-1, 1:-1] = np.frombuffer( self._color, dtype=np.int8).reshape( rows, cols)
+        strings = np.frombuffer( self._string, dtype=np.int16)
+        libs = np.zeros( (rows + 2, cols + 2), dtype=np.int16)
+        libs[1:-1, 1:-1] = np.where( strings >= 0,
+                                     np.frombuffer( self._libs, dtype=np.int16)[strings],
+                                     0).reshape( rows, cols)
+        # Neighbor colors and liberties, one array per side
+        sides = [ (slice( r, r + rows), slice( c, c + cols)) for r,c in ((0,1), (2,1), (1,0), (1,2)) ]
+        side_colors = [ colors[side] for side in sides ]
+        side_libs = [ libs[side] for side in sides ]
+
+        has_liberty = np.zeros( (rows, cols), dtype=bool)
+        captures = np.zeros( (rows, cols), dtype=bool)
+        connects = np.zeros( (rows, cols), dtype=bool) # To a string with liberties left
+        for ncolors, nlibs in zip( side_colors, side_libs):
+            has_liberty |= ncolors == 0
+            captures |= (ncolors == other) & (nlibs == 1)
+            connects |= (ncolors == color) & (nlibs > 1)
+        empty = colors[1:-1, 1:-1] == 0
+        legal = empty & (has_liberty | captures | connects)
+
+        if exclude_own_eyes:
+            # Same as agent_helpers.is_point_an_eye()
+            surrounded = np.ones( (rows, cols), dtype=bool)
+            for ncolors in side_colors:
+                surrounded &= (ncolors == color) | (ncolors == OFF_BOARD)
+            bad_corners = np.zeros( (rows, cols), dtype=np.int8)
+            off_corners = np.zeros( (rows, cols), dtype=np.int8)
+            for r,c in ((0,0), (0,2), (2,0), (2,2)):
+                ccolors = colors[r:r + rows, c:c + cols]
+                bad_corners += ccolors == other
+                off_corners += ccolors == OFF_BOARD
+            eye = surrounded & np.where( off_corners > 0, bad_corners == 0, bad_corners <= 1)
+            legal &= ~eye
+        return legal, empty & captures
+
+    #------------------------------------------
+    def is_self_capture( self, player, point):
+        color = player.value
+        for nb in self._nbrs[self._idx( point)]:
+            nbcolor = self._color[nb]
+            if not nbcolor:
+                # This point has a liberty. Can't be self capture.
+                return False
+            libs = self._libs[self._string[nb]]
+            if nbcolor == color:
+                if libs > 1:
+                    # Connecting to this string leaves a liberty.
+                    return False
+            elif libs == 1:
+                # This move is real capture, not a self capture.
+                return False
+        return True
+
+    #---------------------------------------
+    def will_capture( self, player, point):
+        color = player.value
+        for nb in self._nbrs[self._idx( point)]:
+            nbcolor = self._color[nb]
+            if nbcolor and nbcolor != color and self._libs[self._string[nb]] == 1:
+                # This move would capture.
+                return True
+        return False
+
+    #------------------------------
+    def is_on_grid( self, point):
+        return 1 <= point.row <= self.num_rows and \
+            1 <= point.col <= self.num_cols
+
+    # None if the point is empty or off the board, else the Player
+    #-----------------------------------------------------------------
+    def get( self, point):
+        if not self.is_on_grid( point):
+            return None
+        return COLORS[self._color[self._idx( point)]]
+
+    # None if the point is empty or off the board, else the GoString there
+    #-------------------------------------------------------------------------
+    def get_go_string( self, point):
+        if not self.is_on_grid( point):
+            return None
+        sid = self._string[self._idx( point)]
+        if sid < 0:
+            return None
+        return self._go_string( sid)
+
+    # Return the strings in an array
+    #----------------------------------
+    def get_go_strings( self):
+        return [ self._go_string( sid) for sid in range( len(self._color)) if self._string[sid] == sid ]
+
+    #--------------------------
+    def __eq__( self, other):
+        return isinstance( other, ArrayBoard) and \
+            self.num_rows == other.num_rows and \
+            self.num_cols == other.num_cols and \
+            self._hash == other._hash
+
+    #-------------------------------------
+    def __deepcopy__( self, memodict={}):
+        copied = ArrayBoard.__new__( ArrayBoard)
+        copied.__dict__.update( self.__dict__)
+        copied._color = self._color[:]
+        copied._string = self._string[:]
+        copied._next = self._next[:]
+        copied._size = self._size[:]
+        copied._libs = self._libs[:]
+        copied._trail = []
+        copied._marks = []
+        copied.move_ages = self.move_ages.copy()
+        return copied
+
+    #--------------------------
+    def zobrist_hash( self):
+        return self._hash
+
 # A play, a pass, or a resign. Color *not* included.
 #=======================================================
 class Move():
@@ -365,6 +798,32 @@ class Move():
             other.is_resign,
             other.point)
 
+# The situations (player, hash) along one line of play, with the depth
+# at which each came up first. All states on the line share one table.
+# A state that is not at the end of its line starts a new line,
+# with a copy of the table up to itself, when it gets a child.
+#=========================================================================
+class Lineage():
+
+    #---------------------------------------------
+    def __init__( self, first=None, length=0):
+        self.first = {} if first is None else first # situation -> depth
+        self.length = length # Depths 0..length-1 are in first
+        self.lock = Lock()
+
+    # The state at depth in situation gets a child.
+    # Returns the lineage for the child.
+    #----------------------------------------------------
+    def extend( self, depth, situation):
+        with self.lock:
+            if self.length == depth:
+                self.first.setdefault( situation, depth)
+                self.length += 1
+                return self
+            first = { sit:d for sit,d in self.first.items() if d < depth }
+        first.setdefault( situation, depth)
+        return Lineage( first, depth + 1)
+
 # A board, whose turn, most recent move, and a pointer to zobrist hash of prev board.
 #=====================================================================================
 class GameState():
@@ -375,13 +834,26 @@ class GameState():
         self.next_player = next_player
         self.previous_state = previous
         if previous is None:
-            self.previous_states = frozenset()
+            self.depth = 0
+            self.lineage = Lineage()
         else:
-            self.previous_states = frozenset(
-                previous.previous_states |
-                {(previous.next_player, previous.board.zobrist_hash())})
+            self.depth = previous.depth + 1
+            self.lineage = previous.lineage.extend(
+                previous.depth, (previous.next_player, previous.board.zobrist_hash()))
         self.last_move = move
 
+    # Did we go through this (player, hash) situation before?
+    #------------------------------------------------------------
+    def has_seen( self, situation):
+        depth = self.lineage.first.get( situation)
+        return depth is not None and depth < self.depth
+
+    @property
+    # All the situations before this one. Slow, use has_seen().
+    #---------------------------------------------------------------
+    def previous_states( self):
+        return frozenset( sit for sit,d in self.lineage.first.items() if d < self.depth)
+
     # Make a new game state by applying a move
     #---------------------------------------------
     def apply_move( self, move):
@@ -405,7 +877,7 @@ class GameState():
     def new_game( cls, board_size):
         if isinstance(board_size, int):
             board_size = (board_size, board_size)
-        board = Board(*board_size)
+        board = ArrayBoard(*board_size)
         return GameState(board, Player.black, None, None)
 
     # Suicide rule
@@ -420,17 +892,17 @@ class GameState():
     def situation( self):
         return (self.next_player, self.board)
 
-    # Ko rule
-    #-----------------------------------------------
+    # Ko rule. Positional superko, without copying the board.
+    #------------------------------------------------------------
     def does_move_violate_ko( self, player, move):
         if not move.is_play:
             return False
         if not self.board.will_capture(player, move.point):
             return False
-        next_board = copy.deepcopy( self.board)
-        next_board.place_stone( player, move.point)
-        next_situation = (player.other, next_board.zobrist_hash())
-        return next_situation in self.previous_states
+        if self.board.is_simple_ko( player, move.point):
+            return True
+        next_situation = (player.other, self.board.hash_after( player, move.point))
+        return self.has_seen( next_situation)
 
     # Any move on an empty intersection which isn't suicide or violates ko
     #-----------------------------------------------------------------------
@@ -473,6 +945,12 @@ class GameState():
 
         return moves
 
+    # The board points of legal_moves() as a boolean array of board shape.
+    # With exclude_own_eyes, next_player's own eyes are left out.
+    #-------------------------------------------------------------------------
+    def legal_move_mask( self, exclude_own_eyes=False):
+        return legal_move_mask( self, exclude_own_eyes)
+
     #-------------------
     def winner( self):
         if not self.is_over():
@@ -481,3 +959,127 @@ class GameState():
             return self.next_player
         game_result = scoring.compute_game_result( self)
         return game_result.winner
+
+# GameState.legal_move_mask(), for anything with board, next_player,
+# is_over() and does_move_violate_ko(). Only the captures need a ko check.
+#--------------------------------------------------------------------------
+def legal_move_mask( state, exclude_own_eyes=False):
+    board = state.board
+    if state.is_over():
+        return np.zeros( (board.num_rows, board.num_cols), dtype=bool)
+    legal, captures = board.move_masks( state.next_player, exclude_own_eyes)
+    for idx in np.flatnonzero( legal & captures):
+        row, col = divmod( int(idx), board.num_cols)
+        if state.does_move_violate_ko( state.next_player, Move.play( Point( row + 1, col + 1))):
+            legal[row, col] = False
+    return legal
+
+# A GameState to search from. Owns a copy of the board and changes it
+# with play() and undo(), so trying a move costs what the move changes,
+# not a board copy. board and next_player work like in GameState.
+# Set next_player directly to let one side move twice, undo() restores it.
+#============================================================================
+class SearchState():
+
+    #-----------------------------------
+    def __init__( self, game_state):
+        self.board = copy.deepcopy( game_state.board)
+        self.next_player = game_state.next_player
+        self.last_move = game_state.last_move
+        prev = game_state.previous_state
+        self.second_last_move = prev.last_move if prev is not None else None
+        self.root = game_state
+        # Situations we have been in since the root, and how often
+        self.seen = {}
+        self._stack = []
+
+    # Play a move for next_player
+    #--------------------------------
+    def play( self, move):
+        situation = (self.next_player, self.board.zobrist_hash())
+        self._stack.append( (situation, self.last_move, self.second_last_move))
+        self.seen[situation] = self.seen.get( situation, 0) + 1
+        if move.is_play:
+            self.board.play( self.next_player, move.point)
+        self.next_player = self.next_player.other
+        self.second_last_move = self.last_move
+        self.last_move = move
+
+    # Take back the last play()
+    #-----------------------------
+    def undo( self):
+        if self.last_move.is_play:
+            self.board.undo()
+        situation, self.last_move, self.second_last_move = self._stack.pop()
+        self.next_player = situation[0]
+        n = self.seen[situation] - 1
+        if n:
+            self.seen[situation] = n
+        else:
+            del self.seen[situation]
+
+    #--------------------------
+    def n_played( self):
+        return len( self._stack)
+
+    #----------------------------------------------
+    def is_move_self_capture( self, player, move):
+        if not move.is_play:
+            return False
+        return self.board.is_self_capture( player, move.point)
+
+    @property
+    #---------------------
+    def situation( self):
+        return (self.next_player, self.board)
+
+    # Ko rule, like GameState
+    #-----------------------------------------------
+    def does_move_violate_ko( self, player, move):
+        if not move.is_play:
+            return False
+        if not self.board.will_capture( player, move.point):
+            return False
+        if self.board.is_simple_ko( player, move.point):
+            return True
+        next_situation = (player.other, self.board.hash_after( player, move.point))
+        return next_situation in self.seen or self.root.has_seen( next_situation)
+
+    #-------------------------------
+    def is_valid_move( self, move):
+        if self.is_over():
+            return False
+        if move.is_pass or move.is_resign:
+            return True
+        return (
+            self.board.get( move.point) is None and
+            not self.is_move_self_capture( self.next_player, move) and
+            not self.does_move_violate_ko( self.next_player, move))
+
+    #------------------------
+    def is_over( self):
+        if self.last_move is None:
+            return False
+        if self.last_move.is_resign:
+            return True
+        if self.second_last_move is None:
+            return False
+        return self.last_move.is_pass and self.second_last_move.is_pass
+
+    #--------------------------
+    def legal_moves( self):
+        if self.is_over():
+            return []
+        moves = []
+        for row in range( 1, self.board.num_rows + 1):
+            for col in range( 1, self.board.num_cols + 1):
+                move = Move.play( Point(row, col))
+                if self.is_valid_move( move):
+                    moves.append( move)
+        moves.append( Move.pass_turn())
+        moves.append( Move.resign())
+        return moves
+
+    #-------------------------------------------------------
+    def legal_move_mask( self, exclude_own_eyes=False):
+        return legal_move_mask( self, exclude_own_eyes)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: gtp_client.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Talk GTP to an engine. Every command gets a number, and the
+# '=id' or '?id' answer is matched to the command through a future.
+# Callers can send many commands without waiting for the answers.
+#
+
+from pdb import set_trace as BP
+import re
+from threading import Lock
+from concurrent.futures import Future, InvalidStateError
+import asyncio
+
+# '=12 D4' or '?3 illegal move'
+RESPONSE_RE = re.compile( r'^([=?])(\d*)\s?(.*)$')
+
+#==============================
+class GTPError(Exception):
+    pass
+
+#=================================
+class EngineDiedError(GTPError):
+    pass
+
+#====================
+class GTPClient:
+
+    # Pass future_factory=loop.create_future to use this
+    # from asyncio.
+    #-------------------------------------------------------------------
+    def __init__( self, write_func, diag_handler=None, future_factory=Future):
+        self.write_func = write_func
+        self.diag_handler = diag_handler
+        self.future_factory = future_factory
+        self.lock = Lock()
+        self.next_id = 1
+        self.pending = {} # id -> (cmd, future, on_line)
+        self.current = None # status, future, lines, on_line of the response being read
+
+    # Send a command. Returns a future that resolves to the response text,
+    # or raises GTPError if the engine answers with '?'.
+    # With on_line, each line of the answer goes to on_line as it arrives,
+    # and the future resolves to '' once the answer is complete.
+    # That is for commands like lz-analyze that talk until stopped.
+    #-----------------------------------------------------------------------
+    def send( self, cmd, on_line=None):
+        fut = self.future_factory()
+        with self.lock:
+            cmd_id = self.next_id
+            self.next_id += 1
+            self.pending[cmd_id] = (cmd, fut, on_line)
+        try:
+            self.write_func( '%d %s\n' % (cmd_id, cmd))
+        except OSError as e: # Broken pipe, engine is gone
+            with self.lock:
+                self.pending.pop( cmd_id, None)
+            fut.set_exception( EngineDiedError( str(e)))
+        return fut
+
+    # Send a command and wait for the answer
+    #------------------------------------------------
+    def call( self, cmd, timeout=None):
+        return self.send( cmd).result( timeout)
+
+    # Feed one line of engine stdout. Anything that is not
+    # part of a GTP response goes to the diag handler.
+    #-----------------------------------------------------------
+    def feed_line( self, line):
+        line = line.rstrip('\r\n')
+        if self.current is not None:
+            if line.strip() == '': # Empty line terminates the response
+                self._finish()
+            else:
+                self._add_line( line)
+            return
+        m = RESPONSE_RE.match( line)
+        if m is None:
+            if self.diag_handler and line:
+                self.diag_handler( line)
+            return
+        status, cmd_id, text = m.groups()
+        with self.lock:
+            if cmd_id:
+                cmd_id = int( cmd_id)
+            elif self.pending: # No id. Must be the oldest one.
+                cmd_id = min( self.pending)
+            cmd, fut, on_line = self.pending.pop( cmd_id, (None, None, None))
+        self.current = (status, fut, [], on_line)
+        if text:
+            self._add_line( text)
+
+    # A streamed answer does not pile up in memory
+    #-----------------------------------------------
+    def _add_line( self, line):
+        status, fut, lines, on_line = self.current
+        if on_line is None or status != '=':
+            lines.append( line)
+            return
+        try:
+            on_line( line)
+        except Exception as e:
+            print( 'error: gtp on_line: %s' % str(e))
+
+    #--------------------
+    def _finish( self):
+        status, fut, lines, on_line = self.current
+        self.current = None
+        if fut is None or fut.done(): # Nobody is waiting for this anymore
+            return
+        text = '\n'.join( lines).strip()
+        try:
+            if status == '=':
+                fut.set_result( text)
+            else:
+                fut.set_exception( GTPError( text))
+        except (InvalidStateError, asyncio.InvalidStateError): # Caller cancelled
+            pass
+
+    # The engine is gone. Wake up everybody who is still waiting.
+    #----------------------------------------------------------------
+    def fail_all( self, msg='engine died'):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        if self.current is not None:
+            pending[0] = (None, self.current[1], None)
+            self.current = None
+        for cmd, fut, on_line in pending.values():
+            if fut is None: continue
+            try:
+                fut.set_exception( EngineDiedError( msg))
+            except (InvalidStateError, asyncio.InvalidStateError):
+                pass
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: leela_engine.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# One leelaz subprocess with its own GTP state.
+# Several of these live in an EnginePool behind LeelaGTPBot.
+#
+
+from pdb import set_trace as BP
+import os, sys, re
+import signal
+
+import subprocess
+from threading import Lock
+from concurrent.futures import TimeoutError
+
+from goboard_fast import Move
+from go_utils import point_from_coords, coords_from_point
+from gtp_client import GTPClient, GTPError
+from pipe_reader import PipeReader
+
+MOVE_TIMEOUT = 20 # seconds
+
+# Parse one line of lz-analyze output like
+# info move D4 visits 10 winrate 5012 prior 1234 lcb 4900 order 0 pv D4 Q16 info move ...
+# into a list of dicts. Winrate, prior, lcb are for the side to move, in 0..1 .
+#---------------------------------------------------------------------------------
+def parse_analysis( line):
+    res = []
+    for chunk in line.split( 'info ')[1:]:
+        toks = chunk.split()
+        cand = { 'pv':[] }
+        idx = 0
+        while idx < len(toks):
+            tag = toks[idx]
+            if tag == 'pv':
+                cand['pv'] = toks[idx+1:]
+                break
+            val = toks[idx+1]
+            if tag == 'move':
+                cand['move'] = val
+            elif tag in ('visits', 'order'):
+                cand[tag] = int(val)
+            elif tag in ('winrate', 'prior', 'lcb'):
+                cand[tag] = int(val) / 10000.0
+            idx += 2
+        if 'move' in cand:
+            res.append( cand)
+    return res
+
+#===========================
+class LeelaEngine:
+    #--------------------------------------------
+    # With diagnostics=False, leela's stderr goes to /dev/null
+    # and we don't get a winprob.
+    #--------------------------------------------------------------
+    def __init__( self, leela_cmdline, idx=0, diagnostics=True):
+        self.leela_cmdline = leela_cmdline
+        self.idx = idx
+        self.diagnostics = diagnostics
+        self.handler_lock = Lock()
+        self.win_prob = -1
+        self.last_playouts = -1
+        self.last_visits = -1
+        # The moves leela currently has on its board. None if unknown.
+        self.moves = []
+        self.closed = False
+        # The pool can swap in a spare engine when we die.
+        # Returns True if it did.
+        self.on_death = None
+
+        self.leela_proc, self.gtp, self.leela_reader = self._start_leelaproc()
+
+    #------------------------------
+    def _start_leelaproc( self):
+        stderr = subprocess.PIPE if self.diagnostics else subprocess.DEVNULL
+        proc = subprocess.Popen( self.leela_cmdline, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
+
+        #------------------------
+        def write( cmdstr):
+            proc.stdin.write( cmdstr.encode('utf8'))
+            proc.stdin.flush()
+
+        gtp = GTPClient( write, self._diag_handler)
+        handlers = { proc.stdout: gtp.feed_line }
+        if self.diagnostics:
+            handlers[proc.stderr] = self._diag_handler
+        # The reader only resurrects the process it was started for.
+        # Otherwise killing leela would trigger another restart from
+        # the old reader, and so on forever.
+        reader = PipeReader( handlers, lambda: self._error_handler( proc))
+        return proc, gtp, reader
+
+    #-------------------------
+    def kill( self):
+        if self.leela_proc.pid:
+            try:
+                os.kill( self.leela_proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    # Shut down for good. Don't resurrect.
+    #---------------------------------------
+    def close( self):
+        self.closed = True
+        self.kill()
+
+    # Block until leela has loaded its weights and talks GTP
+    #----------------------------------------------------------
+    def wait_ready( self, timeout=None):
+        self.gtp.call( 'name', timeout)
+
+    # Leela's search output. Pick up the winprob
+    # of the best move.
+    #---------------------------------------------
+    def _diag_handler( self, line):
+        line = line.rstrip()
+        if self.win_prob < 0 and '(V:' in line:
+            print( '<-- %d %s' % (self.idx, line))
+            right = line.split('(V:')[1]
+            self.win_prob = 0.01 * float(right.split('%')[0])
+        elif  '@@' in line:
+            print( line)
+        elif line.endswith( 'n/s') and ' playouts, ' in line:
+            # 123 visits, 456 nodes, 100 playouts, 789 n/s
+            self.last_playouts = int( line.split( ' playouts, ')[0].split()[-1])
+            if ' visits, ' in line:
+                self.last_visits = int( line.split( ' visits, ')[0].split()[-1])
+
+    # Resurrect a dead Leela
+    #-----------------------------------------
+    def _error_handler( self, proc=None):
+        with self.handler_lock:
+            if self.closed: return
+            if proc is not None and proc is not self.leela_proc:
+                return # Already resurrected
+            self.kill()
+            self.moves = None
+            # Mark ourselves closed before waking up the waiters,
+            # so nobody checks a replaced engine back into the pool.
+            replaced = self.on_death is not None and self.on_death( self)
+            if replaced:
+                self.closed = True
+            self.gtp.fail_all( 'leela %d died' % self.idx)
+            if replaced:
+                return
+            print( 'Leela %d died. Resurrecting.' % self.idx)
+            self.leela_proc, self.gtp, self.leela_reader = self._start_leelaproc()
+            print( 'Leela %d resurrected' % self.idx)
+
+    # Convert Leela response string to a Move we understand
+    #--------------------------------------------------------
+    def _resp2Move( self, resp):
+        res = None
+        if 'pass' in resp:
+            res = Move.pass_turn()
+        elif 'resign' in resp:
+            res = Move.resign()
+        elif len(resp.strip()) in (2,3):
+            p = point_from_coords( resp)
+            res = Move.play( p)
+        return res
+
+    # Send a command to leela. Returns a future with the answer.
+    #---------------------------------------------------------------
+    def _leelaCmd( self, cmdstr, on_line=None):
+        return self.gtp.send( cmdstr, on_line)
+
+    # Length of the common prefix of our moves and the given moves
+    #----------------------------------------------------------------
+    def _common_prefix( self, moves):
+        held = self.moves or []
+        n = 0
+        for mine, theirs in zip( held, moves):
+            if mine.upper() != theirs.upper(): break
+            n += 1
+        return n
+
+    # How many GTP commands it takes to get from our position to moves.
+    # Either undo back to the common prefix and play the rest, or
+    # clear_board and replay everything, whichever is shorter.
+    #--------------------------------------------------------------------
+    def sync_cost( self, moves):
+        replay = 1 + len(moves)
+        if self.moves is None:
+            return replay
+        prefix = self._common_prefix( moves)
+        incremental = (len(self.moves) - prefix) + (len(moves) - prefix)
+        return min( incremental, replay)
+
+    # Bring leela's board to the given move list with as few
+    # commands as possible. Keeping the position lets leela
+    # reuse its search tree.
+    # The commands are pipelined. Returns their futures.
+    #----------------------------------------------------------
+    def sync_moves( self, moves):
+        futures = []
+        replay = 1 + len(moves)
+        if self.moves is None or self.sync_cost( moves) == replay:
+            futures.append( self._leelaCmd( 'clear_board'))
+            self.moves = []
+        prefix = self._common_prefix( moves)
+        while len(self.moves) > prefix:
+            futures.append( self._leelaCmd( 'undo'))
+            self.moves.pop()
+        for idx in range( prefix, len(moves)):
+            color = 'b' if idx % 2 == 0 else 'w'
+            futures.append( self._leelaCmd( 'play %s %s' % (color, moves[idx])))
+            self.moves.append( moves[idx])
+        return futures
+
+    # If leela refused any of the sync commands, we don't know
+    # what is on its board anymore.
+    #-----------------------------------------------------------
+    def _check_sync( self, futures):
+        for fut in futures:
+            if fut.done() and fut.exception() is not None:
+                print( 'error: leela %d: %s' % (self.idx, str(fut.exception())))
+                self.moves = None
+                return False
+        return True
+
+    # Let leela look at a position for a while and return the candidate
+    # moves from its last lz-analyze report, best first.
+    #----------------------------------------------------------------------
+    def analyze( self, moves, seconds=1.0, interval_centis=50):
+        last = []
+        def on_info( cands):
+            last[:] = cands
+        sync_futures, fut = self.start_analysis( moves, on_info, interval_centis)
+        try:
+            fut.result( seconds)
+        except TimeoutError:
+            pass
+        if not self.stop_analysis( sync_futures, fut):
+            return []
+        return last
+
+    # Set up the position and start lz-analyze. Every interval_centis,
+    # on_info gets the current candidates as a list of dicts, see parse_analysis().
+    # Leela keeps going until stop_analysis(). Returns (sync_futures, future),
+    # and the future resolves once leela has stopped.
+    #----------------------------------------------------------------------------------
+    def start_analysis( self, moves, on_info, interval_centis=50):
+        def on_line( line):
+            if line.startswith( 'info '):
+                on_info( parse_analysis( line))
+        sync_futures = self.sync_moves( moves)
+        fut = self._leelaCmd( 'lz-analyze %d' % interval_centis, on_line)
+        return sync_futures, fut
+
+    # Any command stops lz-analyze. Wait until leela is done.
+    # Returns False if something went wrong.
+    #-----------------------------------------------------------
+    def stop_analysis( self, sync_futures, fut):
+        if not fut.done():
+            self._leelaCmd( 'name')
+        try:
+            fut.result( MOVE_TIMEOUT)
+        except TimeoutError:
+            print( 'error: leela %d analysis timeout' % self.idx)
+            self._error_handler()
+            return False
+        except GTPError as e:
+            print( 'error: leela %d: %s' % (self.idx, str(e)))
+            self.moves = None
+            return False
+        return self._check_sync( sync_futures)
+
+    # Set up the position and ask leela for a move.
+    # Returns (move, win_prob). Move is None if leela timed out,
+    # refused a move of the position, or if the CancelToken cancel fired.
+    # Afterwards, last_playouts and last_visits say how hard leela looked.
+    #-------------------------------------------------------------------
+    def genmove( self, moves, randomness=0.0, playouts=0, timeout=MOVE_TIMEOUT, cancel=None):
+        self.win_prob = -1
+        self.last_playouts = -1
+        self.last_visits = -1
+
+        sync_futures = self.sync_moves( moves)
+        color = 'b' if len(moves) % 2 == 0 else 'w'
+
+        # Ask for new move
+        cmd = 'genmove ' + color + ' ' + str(randomness) + ' ' + str(playouts)
+        fut = self._leelaCmd( cmd)
+        print( 'sending %s to leela %d' % (cmd, self.idx))
+        # Leela does not listen to stdin while it thinks. The only way to
+        # stop the search is to kill it, and we only do that if a warm spare
+        # can take over. Otherwise leela finishes and we drop the move.
+        # This runs on the canceller's thread, so never restart leela here.
+        proc = self.leela_proc
+        #-------------------
+        def stop_search():
+            with self.handler_lock:
+                if fut.done() or self.closed or proc is not self.leela_proc:
+                    return
+                if self.on_death is None or not self.on_death( self):
+                    print( 'leela %d: search cancelled, no spare. Letting it finish.' % self.idx)
+                    return
+                print( 'leela %d: search cancelled, swapped in a spare' % self.idx)
+                self.closed = True
+                self.moves = None
+                self.kill()
+                self.gtp.fail_all( 'leela %d search cancelled' % self.idx)
+        if cancel is not None:
+            cancel.on_cancel( stop_search)
+        # Hang until the move comes back
+        try:
+            resp = fut.result( timeout)
+        except TimeoutError: # I guess leela died
+            print( 'error: leela %d response timeout' % self.idx)
+            self._error_handler()
+            return None, -1
+        except GTPError as e:
+            print( 'error: leela %d: %s' % (self.idx, str(e)))
+            self.moves = None
+            return None, -1
+        finally:
+            if cancel is not None:
+                cancel.remove( stop_search)
+        # If leela refused a move, it answered for a different position
+        if not self._check_sync( sync_futures):
+            return None, -1
+        res = self._resp2Move( resp)
+        # Leela played its move on its own board
+        self._record_genmove( res)
+        if cancel is not None and cancel.cancelled: # Nobody wants it anymore
+            return None, -1
+        return res, self.win_prob
+
+    # Leela plays the move it generated on its own board.
+    # Remember that.
+    #------------------------------------------------------
+    def _record_genmove( self, res):
+        if res is None or res.is_resign:
+            self.moves = None
+        elif res.is_pass:
+            self.moves.append( 'pass')
+        else:
+            self.moves.append( coords_from_point( res.point))
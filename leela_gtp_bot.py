@@ -13,11 +13,11 @@
 from pdb import set_trace as BP
 import os, sys, re
 import numpy as np
-import signal
-import time
 
-import subprocess
-from threading import Thread,Lock,Event
+import time
+import queue
+import threading
+import contextvars
 import atexit
 
 import goboard_fast as goboard
@@ -25,176 +25,359 @@ from agent_base import Agent
 from agent_helpers import is_point_an_eye
 from goboard_fast import Move
 from gotypes import Point, Player
-from go_utils import point_from_coords
+from go_utils import coords_from_point, point_from_coords
+from leela_engine import LeelaEngine, MOVE_TIMEOUT
+from async_leela_engine import AsyncLeelaEngine
+from engine_pool import EnginePool, AsyncEnginePool, PoolTimeoutError
+from game_sessions import fits_position
+import cancel_token
 
-g_response = None
-g_handler_lock = Lock()
-g_response_event = Event()
-g_win_prob = -1
+# How much longer than its deadline we give leela before we declare it dead
+MOVE_GRACE = 5 # seconds
+# Upper limits for streaming analysis, whatever the client asks for
+ANALYSIS_MAX_SECONDS = 60
+ANALYSIS_MAX_VISITS = 100000
+# Pondering: how many human replies we look at, how long, and how often leela reports
+PONDER_REPLIES = 3
+PONDER_SECONDS = 10
+PONDER_INTERVAL_CENTIS = 10
+# Visits per pondered answer, if we don't know the playouts leelaz was started with
+PONDER_VISITS = 256
 
-MOVE_TIMEOUT = 20 # seconds
 #===========================
 class LeelaGTPBot( Agent):
-    # Listen on a stream in a separate thread until
-    # a line comes in. Process line in a callback.
-    #=================================================
-    class Listener:
-        #------------------------------------------------------------
-        def __init__( self, stream, result_handler, error_handler):
-            self.stream = stream
-            self.result_handler = result_handler
-
-            #--------------------------------------
-            def wait_for_line( stream, callback):
-                global g_response
-                global g_handler_lock
-                global g_response_event
-                global g_win_prob
-                while True:
-                    line = stream.readline().decode()
-                    if line:
-                        result_handler( line)
-                    else: # probably my process died
-                        error_handler()
-                        break
+    # Leela gets the moves, not the board
+    needs_game_state = False
 
-            self.thread = Thread( target = wait_for_line,
-                                  args = (self.stream, self.result_handler))
-            self.thread.daemon = True
-            self.thread.start()
-
-    #--------------------------------------
-    def __init__( self, leela_cmdline):
+    # cache is an optional MoveCache.
+    # n_spares leelas wait loaded and ready to replace a dead one.
+    # scheduler is an optional PlayoutScheduler. Without it, every request
+    # gets the playouts it asks for, however long the line is.
+    # ponder_cache is an optional MoveCache with a short ttl. With it, idle engines
+    # think about the human's likely replies, and the answers wait there.
+    #----------------------------------------------------------------------------------------
+    def __init__( self, leela_cmdline, n_engines=1, cache=None, n_spares=0, scheduler=None,
+                  ponder_cache=None):
         Agent.__init__( self)
         self.leela_cmdline = leela_cmdline
-        self.last_move_color = ''
-
-        self.leela_proc, self.leela_listener = self._start_leelaproc()
-        atexit.register( self._kill_leela)
-
-    #------------------------------
-    def _start_leelaproc( self):
-        proc = subprocess.Popen( self.leela_cmdline, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
-        listener = LeelaGTPBot.Listener( proc.stdout,
-                                         self._result_handler,
-                                         self._error_handler)
-        return proc, listener
-
-    #-------------------------
-    def _kill_leela( self):
-        if self.leela_proc.pid: os.kill( self.leela_proc.pid, signal.SIGKILL)
-
-    # Parse leela response and trigger event to
-    # continue execution.
-    #---------------------------------------------
-    def _result_handler( self, leela_response):
-        global g_response
-        global g_response_event
-        global g_win_prob
-        #with self.handler_lock:
-        line = leela_response
-        if g_win_prob < 0 and '(V:' in line:
-            print( '<-- ' + line)
-            right = line.split('(V:')[1]
-            g_win_prob = 0.01 * float(right.split('%')[0])
-        elif 'NN eval=' in line:
-            pass
-            #g_win_prob = line.split('=')[1]
-        elif  '@@' in line:
-            print( line)
-        elif '=' in line:
-            resp = line.split('=')[1].strip()
-            #print( '<== ' + resp)
-            g_response = self._resp2Move( resp)
-            if g_response:
-                #print(' >>>>>>>>>>>> trigger event')
-                g_response_event.set()
-
-    # Resurrect a dead Leela
-    #---------------------------
-    def _error_handler( self):
-        #print( '>>>>>>>>> err handler')
-        global g_handler_lock
-        with g_handler_lock:
-            print( 'Leela died. Resurrecting.')
-            self._kill_leela()
-            self.leela_proc, self.leela_listener = self._start_leelaproc()
-            print( 'Leela resurrected')
-
-    # Convert Leela response string to a Move we understand
-    #------------------------------
-    def _resp2Move( self, resp):
-        res = None
-        if 'pass' in resp:
-            res = Move.pass_turn()
-        elif 'resign' in resp:
-            res = Move.resign()
-        elif len(resp.strip()) in (2,3):
-            p = point_from_coords( resp)
-            res = Move.play( p)
-        return res
+        self.cache = cache
+        self.scheduler = scheduler
+        self.ponder_cache = ponder_cache
+        # Per request thread: color of the move we generated, and leela's winprob
+        self.tls = threading.local()
 
-    # Send a command to leela
-    #-----------------------------
-    def _leelaCmd( self, cmdstr):
-        cmdstr += '\n'
-        p = self.leela_proc
-        p.stdin.write( cmdstr.encode('utf8'))
-        p.stdin.flush()
-        #print( '--> ' + cmdstr)
+        self.pool = EnginePool( lambda idx: LeelaEngine( leela_cmdline, idx), n_engines, n_spares)
+        atexit.register( self.pool.kill_all)
 
     # Override Agent.select_move()
     #--------------------------------------------------------
     def select_move( self, game_state, moves, config = {}):
-        global g_win_prob
-        global g_response
-        global g_response_event
-        res = None
-        g_win_prob = -1
-        p = self.leela_proc
+        self.tls.last_move_color = ''
+        self.tls.win_prob = -1
 
         randomness = config.get( 'randomness', 0.0)
         playouts = config.get( 'playouts', 0)
+        color = 'b' if len(moves) % 2 == 0 else 'w'
 
-        # Reset the game
-        self._leelaCmd( 'clear_board')
-
-        # Make the moves
-        color = 'b'
-        for move in moves:
-            self._leelaCmd( 'play %s %s' % (color, move))
-            color = 'b' if color == 'w' else 'w'
-
-        # Ask for new move
-        self.last_move_color = color
-        cmd = 'genmove ' + color + ' ' + str(randomness) + ' ' + str(playouts)
-        self._leelaCmd( cmd)
-        print( 'sending ' + cmd)
-        # Hang until the move comes back
-        #print( '>>>>>>>>> waiting')
-        success = g_response_event.wait( MOVE_TIMEOUT)
-        if not success: # I guess leela died
-            print( 'error: leela response timeout')
-            self._error_handler()
-            return None
-        #time.sleep(2)
-        #print( 'reponse: ' + str(g_response))
-        if g_response:
-            res = g_response
-            #print( '>>>>>>>>> cleared event')
-            g_response_event.clear()
-        g_response = None
+        key = self.cache.key( game_state, config) if self.cache else None
+        # Same stones and ko point can still differ in the superko history
+        cached = self.cache.get( key, lambda v: fits_position( game_state, v[0])) if self.cache else None
+        pondered = None
+        if not cached and self.ponder_cache and not randomness:
+            pondered = self.ponder_cache.get( self._ponder_key( moves, playouts))
+        if cached:
+            res, win_prob = cached
+            print( 'cache hit %s' % str(self.cache.stats()))
+        elif pondered:
+            res, win_prob = pondered
+            print( 'ponder hit %s' % str(self.ponder_cache.stats()))
+        else:
+            res, win_prob, full = self._genmove( moves, randomness, playouts, config)
+            # Don't cache answers that got fewer playouts than asked for
+            if self.cache and res is not None and full:
+                self.cache.put( key, (res, win_prob))
+            if res is None and cancel_token.current() is not None:
+                cancel_token.current().check()
+        if not cached and self.ponder_cache and not randomness and res is not None and not res.is_resign:
+            self._start_ponder( moves + [self._move2str( res)], playouts)
+
+        self.tls.last_move_color = color
+        self.tls.win_prob = win_prob
         print( 'leela says: %s' % str(res))
         return res
 
+    # Get a move from the next free engine.
+    # With a scheduler, the playouts depend on the deadline and the load.
+    # Raises DeadlineExceededError if we can't make the deadline.
+    # The current CancelToken, if any, stops the wait and the search.
+    # Returns (move, win_prob, got_all_requested_playouts).
+    #-----------------------------------------------------------------------
+    def _genmove( self, moves, randomness, playouts, config):
+        sched = self.scheduler
+        cancel = cancel_token.current()
+        if sched is None:
+            with self.pool.engine( moves=moves, cancel=cancel) as engine:
+                res, win_prob = engine.genmove( moves, randomness, playouts, cancel=cancel)
+            return res, win_prob, True
+
+        deadline = sched.deadline( config)
+        sched.admit( deadline, self.pool.n_waiting, len(self.pool))
+        try:
+            engine = self.pool.checkout( sched.time_left( deadline), moves, cancel)
+        except PoolTimeoutError:
+            sched.shed( 'no engine before deadline')
+        try:
+            budget = playouts
+            if not randomness: # Otherwise leela only does one playout anyway
+                budget = sched.playouts( deadline, playouts, self.pool.n_waiting, len(self.pool))
+            timeout = min( MOVE_TIMEOUT, sched.time_left( deadline) + MOVE_GRACE)
+            tstart = time.time()
+            res, win_prob = engine.genmove( moves, randomness, budget, timeout, cancel)
+            if res is not None:
+                sched.record( time.time() - tstart, engine.last_playouts)
+        finally:
+            self.pool.checkin( engine)
+        return res, win_prob, budget == (playouts or sched.default_playouts) or bool(randomness)
+
     # Override Agent.diagnostics()
     #------------------------------
     def diagnostics( self):
-        global g_win_prob
-        return { 'winprob': float(g_win_prob) if self.last_move_color=='b' else 1 - float(g_win_prob) }
+        win_prob = getattr( self.tls, 'win_prob', -1)
+        last_move_color = getattr( self.tls, 'last_move_color', '')
+        return { 'winprob': float(win_prob) if last_move_color=='b' else 1 - float(win_prob) }
+
+    # Let an engine analyze the position after moves, and yield its
+    # candidate list every interval_centis, see leela_engine.parse_analysis().
+    # Stops after max_seconds, once the candidates have max_visits between them,
+    # when the caller closes the generator, or when the CancelToken cancel fires.
+    # Then the engine goes back to the pool.
+    # Raises PoolTimeoutError if no engine frees up in time.
+    #-----------------------------------------------------------------------------------
+    def analyze( self, moves, max_visits=1000, max_seconds=10.0, interval_centis=50, cancel=None):
+        max_visits = min( max_visits, ANALYSIS_MAX_VISITS)
+        max_seconds = min( max_seconds, ANALYSIS_MAX_SECONDS)
+        reports = queue.Queue()
+        with self.pool.engine( MOVE_TIMEOUT, moves, cancel) as engine:
+            sync_futures, fut = engine.start_analysis( moves, reports.put, interval_centis)
+            # Leela stopped on its own, or died
+            fut.add_done_callback( lambda f: reports.put( None))
+            if cancel is not None:
+                cancel.on_cancel( lambda: reports.put( None))
+            tend = time.time() + max_seconds
+            try:
+                while time.time() < tend:
+                    try:
+                        cands = reports.get( timeout = max( 0.0, tend - time.time()))
+                    except queue.Empty:
+                        break
+                    if cands is None:
+                        break
+                    yield cands
+                    if sum( [c['visits'] for c in cands]) >= max_visits:
+                        break
+            finally: # Also if the client went away
+                engine.stop_analysis( sync_futures, fut)
+
+    # Let leela pick a move in many positions at once, e.g. every position
+    # of a game for a review. Positions are move lists. Neighboring positions
+    # go to the same engine, which then only needs a few play and undo
+    # commands to get from one to the next. The engines work in parallel,
+    # but a batch uses at most all engines but one, so select_move()
+    # requests still get an engine. With one engine, the batch takes it.
+    # Returns a list of (move, win_prob, visits), win_prob for the side to move.
+    # Move is None where something went wrong.
+    # The current CancelToken, if any, stops the whole batch.
+    #-----------------------------------------------------------------------------
+    def genmove_batch( self, positions, playouts=0):
+        cancel = cancel_token.current()
+        results = [ (None, -1, -1) ] * len(positions)
+        if not positions:
+            return results
+        n_chunks = min( max( 1, len(self.pool) - 1), len(positions))
+        size = (len(positions) + n_chunks - 1) // n_chunks
+        chunks = [ range( start, min( start + size, len(positions)))
+                   for start in range( 0, len(positions), size) ]
+
+        #------------------------
+        def run_chunk( idxs):
+            try:
+                with self.pool.engine( moves=positions[idxs[0]], cancel=cancel) as engine:
+                    for idx in idxs:
+                        if cancel is not None and cancel.cancelled: break
+                        res, win_prob = engine.genmove( positions[idx], 0.0, playouts, cancel=cancel)
+                        results[idx] = (res, win_prob, engine.last_visits)
+            except cancel_token.RequestCancelledError:
+                pass
+
+        threads = [ threading.Thread( target=run_chunk, args=(chunk,)) for chunk in chunks ]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        if cancel is not None:
+            cancel.check()
+        return results
+
+    # Pondered answers are only good for the same position and playouts
+    #----------------------------------------------------------------------
+    def _ponder_key( self, moves, playouts):
+        return ( tuple( [m.upper() for m in moves]), playouts, 0.0 )
+
+    #--------------------------------
+    def _move2str( self, move):
+        return 'pass' if move.is_pass else coords_from_point( move.point)
+
+    #--------------------------------
+    def _str2move( self, move_str):
+        return Move.pass_turn() if move_str.lower() == 'pass' else Move.play( point_from_coords( move_str))
+
+    # While the human thinks about a reply to our last move, let a
+    # spare engine figure out our answers to the likely replies.
+    #-----------------------------------------------------------------
+    def _start_ponder( self, moves, playouts):
+        thread = threading.Thread( target = self._ponder, args = (moves, playouts))
+        thread.daemon = True
+        thread.start()
+
+    # moves ends with leela's move. Analyze the position to find the
+    # replies with the highest policy prior, then analyze each reply and
+    # keep leela's best answer. Stops as soon as a real request needs the engine.
+    #--------------------------------------------------------------------------------
+    def _ponder( self, moves, playouts):
+        state = { 'stopped': False, 'wake': threading.Event() }
+        #-------------------
+        def preempt():
+            state['stopped'] = True
+            state['wake'].set()
+
+        engine = self.pool.checkout_background( preempt, moves)
+        if engine is None: # Everybody busy, no time to ponder
+            return
+        try:
+            visits = playouts or (self.scheduler.default_playouts if self.scheduler else PONDER_VISITS)
+            cands = self._ponder_analyze( engine, moves, visits, state)
+            cands.sort( key = lambda c: -c.get( 'prior', 0.0))
+            for cand in cands[:PONDER_REPLIES]:
+                if cand['move'].lower() == 'resign': continue
+                line = moves + [cand['move']]
+                answers = self._ponder_analyze( engine, line, visits, state)
+                if state['stopped']:
+                    break
+                if not answers or sum( [c['visits'] for c in answers]) < visits:
+                    continue # Not as good as a real genmove
+                best = min( answers, key = lambda c: c.get( 'order', 0))
+                self.ponder_cache.put( self._ponder_key( line, playouts),
+                                       (self._str2move( best['move']), best['winrate']))
+        finally:
+            self.pool.checkin( engine)
+
+    # Run lz-analyze until we have max_visits, PONDER_SECONDS are up,
+    # or we get preempted. Returns the last candidate list.
+    #--------------------------------------------------------------------
+    def _ponder_analyze( self, engine, moves, max_visits, state):
+        wake = state['wake'] = threading.Event()
+        if state['stopped']:
+            return []
+        last = []
+        #--------------------------
+        def on_info( cands):
+            last[:] = cands
+            if sum( [c['visits'] for c in cands]) >= max_visits:
+                wake.set()
+
+        sync_futures, fut = engine.start_analysis( moves, on_info, PONDER_INTERVAL_CENTIS)
+        fut.add_done_callback( lambda f: wake.set())
+        wake.wait( PONDER_SECONDS)
+        if not engine.stop_analysis( sync_futures, fut):
+            return []
+        return list( last)
 
     # Turn an idx 0..360 into a move
     #---------------------------------
     def _idx2move( self, idx):
         point = self.encoder.decode_point_index( idx)
         return goboard.Move.play( point)
+
+# Same as LeelaGTPBot, but select_move() is a coroutine.
+# Call  await bot.start()  on the serving event loop first.
+#===========================================================
+class AsyncLeelaGTPBot( Agent):
+    needs_game_state = False
+
+    #------------------------------------------------------------------------------
+    def __init__( self, leela_cmdline, n_engines=1, cache=None, scheduler=None):
+        Agent.__init__( self)
+        self.leela_cmdline = leela_cmdline
+        self.cache = cache
+        self.scheduler = scheduler
+        # Per request task: color of the move we generated, and leela's winprob
+        self.diag = contextvars.ContextVar( 'leela_diag', default=('', -1))
+        self.pool = AsyncEnginePool( lambda idx: AsyncLeelaEngine.create( leela_cmdline, idx), n_engines)
+        atexit.register( self.pool.kill_all)
+
+    #--------------------------
+    async def start( self):
+        await self.pool.start()
+
+    #--------------------------
+    async def stop( self):
+        self.pool.kill_all()
+        for engine in self.pool.engines:
+            await engine.leela_proc.wait()
+
+    # Override Agent.select_move()
+    #--------------------------------------------------------------
+    async def select_move( self, game_state, moves, config = {}):
+        self.diag.set( ('', -1))
+
+        randomness = config.get( 'randomness', 0.0)
+        playouts = config.get( 'playouts', 0)
+        color = 'b' if len(moves) % 2 == 0 else 'w'
+
+        key = self.cache.key( game_state, config) if self.cache else None
+        # Same stones and ko point can still differ in the superko history
+        cached = self.cache.get( key, lambda v: fits_position( game_state, v[0])) if self.cache else None
+        if cached:
+            res, win_prob = cached
+            print( 'cache hit %s' % str(self.cache.stats()))
+        else:
+            res, win_prob, full = await self._genmove( moves, randomness, playouts, config)
+            # Don't cache answers that got fewer playouts than asked for
+            if self.cache and res is not None and full:
+                self.cache.put( key, (res, win_prob))
+
+        self.diag.set( (color, win_prob))
+        print( 'leela says: %s' % str(res))
+        return res
+
+    # Override Agent.diagnostics()
+    #------------------------------
+    def diagnostics( self):
+        last_move_color, win_prob = self.diag.get()
+        return { 'winprob': float(win_prob) if last_move_color=='b' else 1 - float(win_prob) }
+
+    # Same as LeelaGTPBot._genmove()
+    #-----------------------------------------------------------------------
+    async def _genmove( self, moves, randomness, playouts, config):
+        sched = self.scheduler
+        if sched is None:
+            async with self.pool.engine( moves=moves) as engine:
+                res, win_prob = await engine.genmove( moves, randomness, playouts)
+            return res, win_prob, True
+
+        deadline = sched.deadline( config)
+        sched.admit( deadline, self.pool.n_waiting, len(self.pool))
+        try:
+            engine = await self.pool.checkout( sched.time_left( deadline), moves)
+        except PoolTimeoutError:
+            sched.shed( 'no engine before deadline')
+        try:
+            budget = playouts
+            if not randomness: # Otherwise leela only does one playout anyway
+                budget = sched.playouts( deadline, playouts, self.pool.n_waiting, len(self.pool))
+            timeout = min( MOVE_TIMEOUT, sched.time_left( deadline) + MOVE_GRACE)
+            tstart = time.time()
+            res, win_prob = await engine.genmove( moves, randomness, budget, timeout)
+            if res is not None:
+                sched.record( time.time() - tstart, engine.last_playouts)
+        finally:
+            await self.pool.checkin( engine)
+        return res, win_prob, budget == (playouts or sched.default_playouts) or bool(randomness)
@@ -21,18 +21,47 @@ from flask import jsonify,request,Response,send_file
 
 from gotypes import Point, Player
 from leela_gtp_bot import LeelaGTPBot
+from broker_bot import BrokerClientBot
+from move_cache import MoveCache
+from opening_book import OpeningBook
+from playout_scheduler import PlayoutScheduler
 from get_bot_app import get_bot_app
+from gamestate_cache import GameStateCache
 from sgf import Sgf_game
 from go_utils import coords_from_point, point_from_coords
 import goboard_fast as goboard
 from encoder_base import get_encoder_by_name
 from scoring import compute_nn_game_result
 
-leela_cmd = './leelaz -w best-network -t 1 -p 256 -m 25 --randomtemp 2 -r 0 --noponder '
-leela_gtp_bot = LeelaGTPBot( leela_cmd.split() )
+# Number of leelaz processes. Each one runs single threaded.
+N_ENGINES = int( os.environ.get( 'LEELA_ENGINES', '1'))
+# Loaded leelas waiting to replace one that dies
+N_SPARES = int( os.environ.get( 'LEELA_SPARES', '1'))
+# If set, the engines live in engine_broker.py, shared by all workers
+BROKER_SOCKET = os.environ.get( 'LEELA_BROKER_SOCKET')
+# Opening book from build_opening_book.py, if there is one
+BOOK_FILE = os.environ.get( 'LEELA_BOOK', 'opening_book.bin')
+BOOK = OpeningBook( BOOK_FILE) if os.path.exists( BOOK_FILE) else None
+# Replayed positions, so the next request in a game only replays the new moves
+GAME_STATES = GameStateCache( max_states=20000, snapshot_every=8)
+
+if BROKER_SOCKET:
+    leela_gtp_bot = BrokerClientBot( BROKER_SOCKET)
+else:
+    # Answers for popular positions. Entries expire after a day.
+    MOVE_CACHE = MoveCache( maxsize=100000, ttl=24 * 3600)
+    # Fewer playouts under load, so answers come back within 10 seconds.
+    # Clients can ask for a shorter deadline with config['deadline_ms'].
+    SCHEDULER = PlayoutScheduler( default_deadline=10.0, default_playouts=256)
+    # Idle engines think about the human's likely replies. LEELA_PONDER=0 turns it off.
+    # Those answers are only useful for a couple of minutes.
+    PONDER_CACHE = MoveCache( maxsize=10000, ttl=120) if os.environ.get( 'LEELA_PONDER', '1') != '0' else None
+
+    leela_cmd = './leelaz -w best-network -t 1 -p 256 -m 25 --randomtemp 2 -r 0 --noponder '
+    leela_gtp_bot = LeelaGTPBot( leela_cmd.split(), N_ENGINES, MOVE_CACHE, N_SPARES, SCHEDULER, PONDER_CACHE)
 
 # Get an app with 'select-move/<botname>' endpoints
-app = get_bot_app( {'leela_gtp_bot':leela_gtp_bot} )
+app = get_bot_app( {'leela_gtp_bot':leela_gtp_bot}, BOOK, GAME_STATES)
 
 #----------------------------
 if __name__ == '__main__':
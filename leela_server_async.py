@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+# /********************************************************************
+# Filename: leela_server_async.py
+# Author: AHN
+# Creation Date: Apr, 2019
+# **********************************************************************/
+#
+# Same as leela_server.py, but on asyncio. One process keeps all
+# engines and all waiting requests busy without a thread per request.
+# hypercorn leela_server_async:app --bind 0.0.0.0:2718
+#
+
+from pdb import set_trace as BP
+import os
+
+from leela_gtp_bot import AsyncLeelaGTPBot
+from move_cache import MoveCache
+from opening_book import OpeningBook
+from playout_scheduler import PlayoutScheduler
+from get_bot_app_async import get_bot_app_async
+from gamestate_cache import GameStateCache
+
+# Number of leelaz processes. Each one runs single threaded.
+N_ENGINES = int( os.environ.get( 'LEELA_ENGINES', '1'))
+# Answers for popular positions. Entries expire after a day.
+MOVE_CACHE = MoveCache( maxsize=100000, ttl=24 * 3600)
+# Fewer playouts under load, so answers come back within 10 seconds.
+# Clients can ask for a shorter deadline with config['deadline_ms'].
+SCHEDULER = PlayoutScheduler( default_deadline=10.0, default_playouts=256)
+# Opening book from build_opening_book.py, if there is one
+BOOK_FILE = os.environ.get( 'LEELA_BOOK', 'opening_book.bin')
+BOOK = OpeningBook( BOOK_FILE) if os.path.exists( BOOK_FILE) else None
+# Replayed positions, so the next request in a game only replays the new moves
+GAME_STATES = GameStateCache( max_states=20000, snapshot_every=8)
+
+leela_cmd = './leelaz -w best-network -t 1 -p 256 -m 25 --randomtemp 2 -r 0 --noponder '
+leela_gtp_bot = AsyncLeelaGTPBot( leela_cmd.split(), N_ENGINES, MOVE_CACHE, SCHEDULER)
+
+# Get an app with 'select-move/<botname>' endpoints
+app = get_bot_app_async( {'leela_gtp_bot':leela_gtp_bot}, BOOK, GAME_STATES)
+
+#----------------------------
+if __name__ == '__main__':
+    app.run( host='127.0.0.1', port=2718, debug=True)
@@ -19,7 +19,6 @@ import tensorflow as tf
 
 import goboard_fast as goboard
 from agent_base import Agent
-from agent_helpers import is_point_an_eye
 from goboard_fast import Move
 from gotypes import Point, Player
 from encoder_base import get_encoder_by_name
@@ -73,16 +72,10 @@ class LeelaBot( Agent):
 
     #-------------------------------------------------------------
     def _find_move( self, game_state, n_best, n_rollouts, depth):
-        num_moves = BSZ * BSZ
         move_probs = self._predict( game_state)
-        candidates = np.arange( num_moves)
-        ranked_moves = sorted( candidates, key = lambda idx: move_probs[idx], reverse=True)
-        good_moves = []
-        for point_idx in ranked_moves:
-            point = self.encoder.decode_point_index( point_idx)
-            if game_state.is_valid_move( goboard.Move.play( point)):
-                if not is_point_an_eye( game_state.board, point, game_state.next_player):
-                    good_moves.append(point_idx)
+        # Legal moves that don't fill our own eyes, best first
+        candidates = np.flatnonzero( game_state.legal_move_mask( exclude_own_eyes=True))
+        good_moves = list( candidates[ np.argsort( -move_probs[candidates], kind='stable') ])
         n_best = min( n_best, len(good_moves))
         if n_best == 0: return (goboard.Move.pass_turn(), 0)
         med_scores = []
@@ -107,19 +100,20 @@ class LeelaBot( Agent):
         res = (goboard.Move.play( point), med_scores[best_idx])
         return res
 
-    # Roll out one move to the given depth
-    #----------------------------------------------
+    # Roll out one move to the given depth, on one board copy
+    #------------------------------------------------------------
     def _rollout( self, game_state, move, depth):
         num_moves = BSZ * BSZ
         candidates = np.arange( num_moves)
-        game_state = game_state.apply_move( move)
+        search = goboard.SearchState( game_state)
+        search.play( move)
         for d in range(depth):
-            move_probs = self._predict(game_state)
+            move_probs = self._predict( search)
             # Pick next move from policy net distribution
             move_idx = np.random.choice( candidates, 1, p=move_probs)[0]
             move = self._idx2move( move_idx)
-            game_state = game_state.apply_move( move)
-        return game_state
+            search.play( move)
+        return search
 
     # Estimate score for a game state
     #------------------------------------
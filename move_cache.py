@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: move_cache.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Remember bot answers by position, so popular positions
+# don't cost a search every time.
+# Keyed by position, see game_sessions.position_key(), and the search config.
+# LRU eviction, optional TTL, hit/miss counters.
+# With randomness, we keep a few different answers per position
+# and pick one at random, so play stays varied.
+#
+
+from pdb import set_trace as BP
+import time
+import random
+from collections import OrderedDict
+from threading import Lock
+
+from game_sessions import position_key
+
+#===================
+class MoveCache:
+
+    #-------------------------------------------------------------
+    def __init__( self, maxsize=10000, ttl=None, n_samples=4):
+        self.maxsize = maxsize
+        self.ttl = ttl # seconds, or None for forever
+        self.n_samples = n_samples
+        self.lock = Lock()
+        self.entries = OrderedDict() # key -> (created, [values])
+        self.hits = 0
+        self.misses = 0
+
+    # The cache key for a position and a config dict
+    #--------------------------------------------------
+    def key( self, game_state, config):
+        return ( position_key( game_state),
+                 config.get( 'playouts', 0),
+                 float( config.get( 'randomness', 0.0)) )
+
+    # Randomized configs want several different answers per key
+    #-------------------------------------------------------------
+    def _is_random( self, key):
+        return key[-1] > 0
+
+    # Return a cached value, or None.
+    # For random configs, this is a miss until we have
+    # n_samples answers to choose from.
+    # Values where is_valid( value) is False don't count.
+    #------------------------------------------------------
+    def get( self, key, is_valid=None):
+        with self.lock:
+            entry = self.entries.get( key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None or (self._is_random( key) and len(entry[1]) < self.n_samples):
+                self.misses += 1
+                return None
+            values = entry[1]
+            if is_valid is not None:
+                values = [v for v in values if is_valid( v)]
+            if not values:
+                self.misses += 1
+                return None
+            self.entries.move_to_end( key)
+            self.hits += 1
+            return random.choice( values)
+
+    #---------------------------
+    def put( self, key, value):
+        with self.lock:
+            entry = self.entries.get( key)
+            if entry is None:
+                entry = (time.time(), [])
+                self.entries[key] = entry
+            values = entry[1]
+            if self._is_random( key):
+                if len(values) < self.n_samples:
+                    values.append( value)
+            else:
+                values[:] = [value]
+            self.entries.move_to_end( key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem( last=False)
+
+    #-------------------
+    def clear( self):
+        with self.lock:
+            self.entries.clear()
+
+    #-------------------
+    def stats( self):
+        with self.lock:
+            total = self.hits + self.misses
+            return { 'hits': self.hits,
+                     'misses': self.misses,
+                     'hit_rate': self.hits / total if total else 0.0,
+                     'size': len(self.entries) }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: opening_book.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# A precomputed opening book, memory mapped.
+# The file is a small header followed by fixed size records
+# sorted by key. Each record is one candidate move for one position.
+# Lookup is a binary search, no engine involved.
+# Build books with build_opening_book.py .
+#
+
+from pdb import set_trace as BP
+import struct
+import numpy as np
+
+import zobrist
+from gotypes import Player, Point
+from go_utils import coords_from_point, point_from_coords
+
+MAGIC = b'LZBOOK02'
+# magic, zobrist tag, board size, most moves in a book position, number of records
+HEADER = struct.Struct( '<8sQIII')
+# Older books don't know their depth
+MAGIC_V1 = b'LZBOOK01'
+HEADER_V1 = struct.Struct( '<8sQII')
+RECORD_DTYPE = np.dtype( [ ('key', '<u8'),
+                           ('move', '<u2'),
+                           ('weight', '<f4'),
+                           ('winrate', '<f4') ] )
+# Flips the key if white is to move
+WHITE_TO_MOVE = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+# Book key for a position and side to move
+#--------------------------------------------
+def book_key( game_state):
+    key = game_state.board.zobrist_hash() & MASK64
+    if game_state.next_player == Player.white:
+        key ^= WHITE_TO_MOVE
+    return key
+
+# 'D4' -> 0..360, 'pass' -> 361
+#--------------------------------------
+def encode_move( move_str, board_size):
+    if move_str.lower() == 'pass':
+        return board_size * board_size
+    p = point_from_coords( move_str.upper())
+    return (p.row - 1) * board_size + p.col - 1
+
+#--------------------------------------
+def decode_move( idx, board_size):
+    if idx == board_size * board_size:
+        return 'pass'
+    return coords_from_point( Point( row = idx // board_size + 1, col = idx % board_size + 1))
+
+# Write a book file.
+# entries maps book_key -> list of (move_str, weight, winrate),
+# winrate for the side to move. max_moves is the length of the
+# longest move list in the book, 0 if we don't know.
+#--------------------------------------------------------------------
+def write_book( path, entries, board_size=19, max_moves=0):
+    rows = []
+    for key in sorted( entries):
+        for move_str, weight, winrate in entries[key]:
+            rows.append( (key, encode_move( move_str, board_size), weight, winrate))
+    records = np.array( rows, dtype=RECORD_DTYPE)
+    with open( path, 'wb') as f:
+        f.write( HEADER.pack( MAGIC, zobrist.EMPTY_BOARD, board_size, max_moves, len(records)))
+        f.write( records.tobytes())
+
+#======================
+class OpeningBook:
+
+    #--------------------------
+    def __init__( self, path):
+        with open( path, 'rb') as f:
+            head = f.read( HEADER.size)
+        header = { MAGIC:HEADER, MAGIC_V1:HEADER_V1 }.get( head[:len(MAGIC)])
+        if header is None or len(head) < header.size:
+            raise ValueError( '%s is not an opening book' % path)
+        if header is HEADER_V1:
+            magic, tag, self.board_size, n = HEADER_V1.unpack( head[:HEADER_V1.size])
+            self.max_moves = 0
+        else:
+            magic, tag, self.board_size, self.max_moves, n = HEADER.unpack( head)
+        # A book built with different zobrist codes has meaningless keys
+        if tag != zobrist.EMPTY_BOARD:
+            raise ValueError( '%s was built with a different zobrist table. Rebuild it.' % path)
+        if n:
+            self.records = np.memmap( path, dtype=RECORD_DTYPE, mode='r', offset=header.size, shape=(n,))
+        else:
+            self.records = np.zeros( 0, dtype=RECORD_DTYPE)
+        self.keys = self.records['key']
+
+    #--------------------
+    def __len__( self):
+        return len( self.records)
+
+    # Could a position after n_moves be in the book?
+    # If not, we don't need a board to find out.
+    #---------------------------------------------------
+    def covers( self, n_moves):
+        return not self.max_moves or n_moves <= self.max_moves
+
+    # All candidates for a position as (move_str, weight, winrate),
+    # best first. Empty list if the position is not in the book.
+    #-----------------------------------------------------------------
+    def lookup( self, game_state):
+        board = game_state.board
+        if board.num_rows != self.board_size or board.num_cols != self.board_size:
+            return []
+        key = np.uint64( book_key( game_state))
+        lo = np.searchsorted( self.keys, key, side='left')
+        hi = np.searchsorted( self.keys, key, side='right')
+        res = [ (decode_move( int(r['move']), self.board_size), float(r['weight']), float(r['winrate']))
+                for r in self.records[lo:hi] ]
+        res.sort( key=lambda c: -c[1])
+        return res
+
+    # Pick a book move. Best one without randomness, else
+    # random by weight. Returns (move_str, winrate) or None.
+    #---------------------------------------------------------
+    def choose( self, game_state, randomness=0.0):
+        cands = self.lookup( game_state)
+        if not cands:
+            return None
+        if randomness <= 0:
+            move_str, weight, winrate = cands[0]
+            return move_str, winrate
+        weights = np.array( [c[1] for c in cands], dtype=float)
+        if weights.sum() <= 0:
+            weights[:] = 1.0
+        idx = np.random.choice( len(cands), p = weights / weights.sum())
+        move_str, weight, winrate = cands[idx]
+        return move_str, winrate
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: pipe_reader.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Read lines from the pipes of a subprocess in one thread.
+# We read big chunks with os.read() whenever select says there
+# is data, and split lines ourselves. Much cheaper than readline()
+# on an unbuffered pipe, which costs a syscall per byte.
+#
+
+from pdb import set_trace as BP
+import os
+import selectors
+from threading import Thread
+
+CHUNK_SIZE = 65536
+
+#=====================
+class PipeReader:
+
+    # handlers maps a readable stream to a function taking one line.
+    # A handler of None means drain the pipe and drop the lines.
+    # eof_handler gets called once all pipes are closed.
+    #----------------------------------------------------------------
+    def __init__( self, handlers, eof_handler):
+        self.eof_handler = eof_handler
+        self.selector = selectors.DefaultSelector()
+        for stream, handler in handlers.items():
+            self.selector.register( stream.fileno(), selectors.EVENT_READ, [handler, b''])
+
+        self.thread = Thread( target = self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #------------------
+    def _run( self):
+        while self.selector.get_map():
+            for key, _ in self.selector.select():
+                self._read( key)
+        self.selector.close()
+        self.eof_handler()
+
+    #---------------------------
+    def _read( self, key):
+        handler, partial = key.data
+        try:
+            chunk = os.read( key.fd, CHUNK_SIZE)
+        except OSError:
+            chunk = b''
+        if not chunk: # Closed. Flush what's left.
+            self.selector.unregister( key.fd)
+            if partial and handler:
+                handler( partial.decode( 'utf8', 'replace'))
+            return
+        if handler is None:
+            return
+        lines = (partial + chunk).split( b'\n')
+        key.data[1] = lines.pop()
+        for line in lines:
+            handler( line.decode( 'utf8', 'replace') + '\n')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: playout_scheduler.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Decide how many playouts a request can afford, given its deadline,
+# the number of requests waiting for an engine, and how many playouts
+# per second the engines have been doing lately.
+# Requests that can't make their deadline get shed.
+#
+
+from pdb import set_trace as BP
+import time
+from threading import Lock
+
+#========================================
+class DeadlineExceededError(Exception):
+    pass
+
+#==========================
+class PlayoutScheduler:
+
+    #------------------------------------------------------------------------
+    def __init__( self, default_deadline=10.0, default_playouts=256,
+                  min_playouts=16, playouts_per_sec=100.0, alpha=0.2):
+        self.default_deadline = default_deadline # seconds
+        self.default_playouts = default_playouts # what leelaz -p says
+        self.min_playouts = min_playouts # Not worth searching with fewer
+        self.alpha = alpha # For the moving averages
+        self.lock = Lock()
+        self.playouts_per_sec = playouts_per_sec
+        self.service_time = 1.0 # seconds per genmove, including setup
+        self.overhead = 0.05 # seconds per genmove that don't depend on playouts
+        self.n_shed = 0
+
+    # Absolute deadline for a request starting now.
+    # Clients can send config['deadline_ms'].
+    #--------------------------------------------------
+    def deadline( self, config):
+        budget = config.get( 'deadline_ms')
+        budget = budget / 1000.0 if budget else self.default_deadline
+        return time.time() + budget
+
+    # Before waiting in line. Shed the request if the expected wait
+    # alone is longer than its deadline.
+    #------------------------------------------------------------------
+    def admit( self, deadline, n_waiting, n_engines):
+        expected_wait = self.service_time * n_waiting / float(n_engines)
+        if time.time() + expected_wait > deadline:
+            self.shed( 'expected wait %.1fs exceeds deadline' % expected_wait)
+
+    # How long we can wait for an engine
+    #--------------------------------------
+    def time_left( self, deadline):
+        return max( 0.0, deadline - time.time())
+
+    # After we got an engine. Pick a playout count that finishes in time,
+    # and leaves time for the requests still waiting behind us.
+    #-----------------------------------------------------------------------
+    def playouts( self, deadline, requested, n_waiting, n_engines):
+        requested = requested or self.default_playouts
+        remaining = deadline - time.time() - self.overhead
+        if remaining <= 0:
+            self.shed( 'deadline passed while waiting for an engine')
+        share = remaining / (1.0 + n_waiting / float(n_engines))
+        affordable = int( self.playouts_per_sec * share)
+        res = min( requested, affordable)
+        if res < min( self.min_playouts, requested):
+            self.shed( 'only %d playouts left before deadline' % affordable)
+        return res
+
+    # Learn from a finished genmove
+    #------------------------------------------------
+    def record( self, elapsed, playouts):
+        with self.lock:
+            self.service_time += self.alpha * (elapsed - self.service_time)
+            # A handful of playouts only measures the overhead
+            if playouts >= self.min_playouts and elapsed > self.overhead:
+                rate = playouts / (elapsed - self.overhead)
+                self.playouts_per_sec += self.alpha * (rate - self.playouts_per_sec)
+            elif 0 <= playouts < self.min_playouts:
+                self.overhead += self.alpha * (elapsed - self.overhead)
+
+    # Give up on a request
+    #-------------------------
+    def shed( self, msg):
+        with self.lock:
+            self.n_shed += 1
+        raise DeadlineExceededError( msg)
+
+    #-------------------
+    def stats( self):
+        return { 'playouts_per_sec': self.playouts_per_sec,
+                 'service_time': self.service_time,
+                 'overhead': self.overhead,
+                 'n_shed': self.n_shed }
@@ -44,10 +44,10 @@ class ScoreThreeplaneEncoder(Encoder):
         for r in range( self.board_height):
             for c in range( self.board_width):
                 p = Point( row = r + 1, col = c + 1)
-                go_string = game_state.board.get_go_string( p)
-                if go_string is None:
+                color = game_state.board.get( p)
+                if color is None:
                     continue
-                if go_string.color == Player.black:
+                if color == Player.black:
                     board_matrix[r, c, 0] = 1
                 else:
                     board_matrix[r, c, 1] = 1
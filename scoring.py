@@ -312,6 +312,8 @@ def fix_seki( white_probs, game_state_, terrmap):
     print( 'fix_seki %s to move' % ('b' if game_state_.next_player == Player.black else 'w'))
 
     strs = game_state.board.get_go_strings()
+    # Try the fills on one board, and take them back after each string
+    search = goboard_fast.SearchState( game_state)
 
     for gostr in strs:
         for p in gostr.stones: break # get any from set
@@ -321,42 +323,47 @@ def fix_seki( white_probs, game_state_, terrmap):
         if not dead: continue
 
         # Try to fill the liberties of the supposedly dead string
-        gs = game_state
-        gs.next_player = gostr.color.other
+        search.next_player = gostr.color.other
         couldfill = True
         seki = False
         while( couldfill):
             couldfill = False
-            gstr = gs.board.get_go_string( p)
+            gstr = search.board.get_go_string( p)
             if gstr is None: # we captured them, they were dead alright
                 break
             # Play all moves that aren't self-atari
             for lib in gstr.liberties:
                 move = goboard_fast.Move( lib)
-                if not gs.is_move_self_capture( gostr.color.other, move):
-                    temp = gs.apply_move( move)
-                    oppstr = temp.board.get_go_string(lib)
+                if not search.is_move_self_capture( gostr.color.other, move):
+                    search.play( move)
+                    oppstr = search.board.get_go_string(lib)
                     if len(oppstr.liberties) > 1: # not self atari
-                        gs = temp # let's actually play there
-                        gs.next_player = gostr.color.other # reset whose turn
+                        # let's actually play there
+                        search.next_player = gostr.color.other # reset whose turn
                         couldfill = True
+                    else:
+                        search.undo()
 
             if couldfill: continue
 
-            gstr = gs.board.get_go_string( p)
+            gstr = search.board.get_go_string( p)
             seki = True
             # Maybe self atari is all we can do
             if gstr is not None: # we didn't capture without self atari
                 for lib in gstr.liberties:
                     move = goboard_fast.Move( lib)
-                    if not gs.is_move_self_capture( gostr.color.other, move): # uschmidt.sgf
+                    if not search.is_move_self_capture( gostr.color.other, move): # uschmidt.sgf
                         seki = False
-                        temp = gs.apply_move( move)
-                        oppstr = temp.board.get_go_string(lib)
+                        search.play( move)
+                        oppstr = search.board.get_go_string(lib)
                         if len(oppstr.stones) > 6: # not nakade, it's a seki
                             seki = True
+                        search.undo()
                         break
 
+        while search.n_played():
+            search.undo()
+
         if seki:
             myprob = 1.0 if gostr.color == Player.white else 0.0
             # All the dead stones are alive
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# /*********************************
+# Filename: single_flight.py
+# Creation Date: Apr, 2019
+# Author: AHN
+# **********************************/
+#
+# Identical requests that arrive while the first one is still being
+# computed don't get computed again. They wait for the first one
+# and get the same answer, or the same exception.
+# The shared call only gets cancelled once all its callers gave up.
+#
+
+from pdb import set_trace as BP
+import asyncio
+from threading import Lock, Event
+from concurrent.futures import Future
+
+import cancel_token
+from cancel_token import CancelToken
+
+# One call in flight
+#=================
+class _Call:
+    #----------------------
+    def __init__( self, key):
+        self.key = key
+        self.fut = Future()
+        self.token = CancelToken() # Current while the call runs
+        self.n_callers = 0
+
+#=====================
+class SingleFlight:
+
+    #----------------------
+    def __init__( self):
+        self.lock = Lock()
+        self.calls = {} # key -> _Call
+        self.n_shared = 0
+
+    # Return func(), unless a call with the same key is already
+    # running. Then wait for that one and return its result.
+    # If the caller's CancelToken cancel fires, the caller stops waiting
+    # with RequestCancelledError. func() sees a token of its own as
+    # cancel_token.current(), which fires when the last caller gives up.
+    #------------------------------------------------------------------------
+    def do( self, key, func, cancel=None):
+        with self.lock:
+            call = self.calls.get( key)
+            leader = call is None
+            if leader:
+                call = _Call( key)
+                self.calls[key] = call
+            else:
+                self.n_shared += 1
+            call.n_callers += 1
+        if cancel is not None:
+            cancel.on_cancel( lambda: self._leave( call))
+        if not leader:
+            return self._wait( call, cancel)
+        try:
+            with cancel_token.use( call.token):
+                res = func()
+            call.fut.set_result( res)
+            return res
+        except BaseException as e:
+            call.fut.set_exception( e)
+            if cancel is not None and isinstance( e, cancel_token.RequestCancelledError):
+                cancel.check() # Our own reason is more useful
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get( key) is call:
+                    del self.calls[key]
+
+    # A caller gave up. If it was the last one, stop the call.
+    # A cancelled call is no good to anybody, so new callers
+    # start a new one.
+    #------------------------------------------------------------
+    def _leave( self, call):
+        with self.lock:
+            call.n_callers -= 1
+            last = call.n_callers == 0
+            if last and self.calls.get( call.key) is call:
+                del self.calls[call.key]
+        if last:
+            call.token.cancel( 'all callers gave up')
+
+    #--------------------------------
+    def _wait( self, call, cancel):
+        if cancel is None:
+            return call.fut.result()
+        done = Event()
+        call.fut.add_done_callback( lambda f: done.set())
+        cancel.on_cancel( done.set)
+        done.wait()
+        if not call.fut.done():
+            cancel.check()
+        return call.fut.result()
+
+    #-------------------
+    def stats( self):
+        with self.lock:
+            return { 'in_flight': len(self.calls), 'shared': self.n_shared }
+
+# Same for coroutines. The call runs in its own task, so a client
+# that goes away does not cancel it for everybody else.
+#===================================================================
+class AsyncSingleFlight:
+
+    #----------------------
+    def __init__( self):
+        self.calls = {} # key -> Task
+        self.n_shared = 0
+
+    # Await coro_func(), or the call already running for key
+    #-----------------------------------------------------------
+    async def do( self, key, coro_func):
+        task = self.calls.get( key)
+        if task is None:
+            task = asyncio.ensure_future( coro_func())
+            self.calls[key] = task
+            task.add_done_callback( lambda t: self.calls.pop( key, None))
+        else:
+            self.n_shared += 1
+        return await asyncio.shield( task)
+
+    #-------------------
+    def stats( self):
+        return { 'in_flight': len(self.calls), 'shared': self.n_shared }
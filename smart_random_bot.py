@@ -15,8 +15,7 @@ import numpy as np
 import random
 
 from agent_base import Agent
-from agent_helpers import is_point_an_eye
-from goboard_fast import Move
+from goboard_fast import Move, SearchState
 from gotypes import Point
 
 #=================================
@@ -37,56 +36,64 @@ class SmartRandomBot(Agent):
             for c in range( 1, cols + 1):
                 self.point_cache.append( Point(row=r, col=c))
 
+    # Liberties of the string at lib after playing there
+    #------------------------------------------------------
+    def _libs_after( self, search, lib):
+        search.play( Move.play( lib))
+        res = search.board.get_go_string( lib).num_liberties
+        search.undo()
+        return res
+
     # See if we can escape an atari to save some stones
     #------------------------------------------------------
-    def save_atari( self, game_state):
-        pl = game_state.next_player
-        atari_strings = game_state.board.strings_in_atari( pl)
+    def save_atari( self, search):
+        pl = search.next_player
+        atari_strings = search.board.strings_in_atari( pl)
         for astr in atari_strings:
             lib = next( iter( astr.liberties))
             cand =  Move.play( lib)
-            if game_state.is_valid_move( cand):
-                newstate = game_state.apply_move( cand)
-                if newstate.board.get_go_string( lib).num_liberties > 1:
+            if search.is_valid_move( cand):
+                if self._libs_after( search, lib) > 1:
                     return cand
         return None
 
     # See if we can capture stones
     #-----------------------------------
-    def capture( self, game_state):
-        opp = game_state.next_player.other
-        atari_strings = game_state.board.strings_in_atari( opp)
+    def capture( self, search):
+        opp = search.next_player.other
+        atari_strings = search.board.strings_in_atari( opp)
         for astr in atari_strings:
             for lib in astr.liberties:
                 cand =  Move.play( lib)
-                if game_state.is_valid_move( cand):
+                if search.is_valid_move( cand):
                     return cand
         return None
 
     # See if we can atari stones
     #-----------------------------------
-    def atari( self, game_state):
-        opp = game_state.next_player.other
-        lib2_strings = game_state.board.strings_with_liberties( opp, 2)
+    def atari( self, search):
+        opp = search.next_player.other
+        lib2_strings = search.board.strings_with_liberties( opp, 2)
         for astr in lib2_strings:
             for lib in astr.liberties:
                 cand =  Move.play( lib)
-                if game_state.is_valid_move( cand):
-                    newstate = game_state.apply_move( cand)
-                    if newstate.board.get_go_string( lib).num_liberties > 1:
+                if search.is_valid_move( cand):
+                    if self._libs_after( search, lib) > 1:
                         return cand
         return None
 
     #--------------------------------------
     def select_move( self, game_state, _):
+        # Try moves on one board copy instead of a copy per move
+        search = SearchState( game_state)
 
-        cand = self.save_atari( game_state)
+        cand = self.save_atari( search)
         if cand:
             return cand
-        cand = self.capture( game_state)
+        cand = self.capture( search)
         if cand:
             return cand
-        cand = self.atari( game_state)
+        cand = self.atari( search)
         if cand:
             return cand
 
@@ -94,13 +101,8 @@ class SmartRandomBot(Agent):
         if dim != self.dim:
             self._update_cache( dim)
 
-        idx = np.arange( len( self.point_cache))
-        np.random.shuffle( idx)
-        for i in idx:
-            p = self.point_cache[i]
-            if (game_state.is_valid_move( Move.play( p)) and
-                not is_point_an_eye( game_state.board,
-                                     p,
-                                     game_state.next_player)):
-                return Move.play( p)
+        # Any legal move that doesn't fill our own eye
+        candidates = np.flatnonzero( search.legal_move_mask( exclude_own_eyes=True))
+        if len( candidates):
+            return Move.play( self.point_cache[ np.random.choice( candidates)])
         return Move.pass_turn()